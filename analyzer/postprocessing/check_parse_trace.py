@@ -0,0 +1,101 @@
+import sys
+import time
+import polars as pl
+from parsing import parse_trace, read_trace_metadata
+
+
+if len(sys.argv) not in (2, 3):
+    print("missing argument: [uncompressed CSV or JSONL trace without kernel flow counts] [tracer log, for traces without command names]")
+    exit(1)
+
+
+# compares parse_trace with the row-by-row flow count reconstruction it replaced and prints how long each takes
+REPEATS = 3
+
+
+def baseline_parse_trace(filename):
+    """
+    parse_trace as it was before the vectorized reconstruction, kept as the reference
+    """
+    if filename.endswith("csv"):
+        trace = pl.read_csv(filename, comment_char="#")
+    elif filename.endswith("jsonl"):
+        trace = pl.read_ndjson(filename)
+    else:
+        assert False, "unexpected file extension"
+
+    cmd_change = {
+        "CMD_NEW": lambda s: s + 1,
+        "CMD_DEL": lambda s: s - 1,
+        "CMD_SET": lambda s: s,
+    }
+
+    table_change = {
+        "TABLE_FLUSH": lambda s: 0,
+        "TABLE_REMOVE": lambda s: s - 1,
+        "TABLE_INSERT": lambda s: s + 1,
+    }
+
+    def process(vtable):
+        n_flows = 0
+        ts = []
+        flows = []
+        keys = vtable.keys()
+
+        for row in trace.filter(trace["event"].is_in(keys)).iter_rows(named=True):
+            ts.append(row['ts']-1)
+            flows.append(n_flows)
+
+            # we must be sure that the event is always there
+            n_flows = vtable[row["event"]](n_flows)
+
+            ts.append(row["ts"])
+            flows.append(n_flows)
+
+        return pl.DataFrame({"ts": ts, "flows": flows})
+
+    upcalls = trace.filter(trace["event"] == "UPCALL")
+    return (process(table_change), process(cmd_change), upcalls)
+
+
+def timed(f, *args):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = f(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+filename = sys.argv[1]
+log = sys.argv[2] if len(sys.argv) == 3 else None
+if read_trace_metadata(filename).get("sample_rate", 1) > 1:
+    print("warning: sampled trace, the reconstructed flow counts are not meaningful")
+
+# without the Parquet cache of parsing.cached
+expected, baseline_sec = timed(baseline_parse_trace, filename)
+if "flows" in expected[2].columns:
+    print("the trace has the flow counts from the kernel, parse_trace doesn't reconstruct them. use an older trace")
+    exit(1)
+result, parse_sec = timed(parse_trace.__wrapped__, filename, log)
+
+same = True
+for name, exp, res in zip(["table flows", "cmd flows"], expected, result):
+    res = res.select([pl.col("ts").cast(pl.Int64), pl.col("flows").cast(pl.Int64)])
+    exp = exp.select([pl.col("ts").cast(pl.Int64), pl.col("flows").cast(pl.Int64)])
+    if not res.frame_equal(exp):
+        same = False
+        print(f"{name} differ: {len(exp)} rows in the baseline, {len(res)} in parse_trace")
+        if len(exp) == len(res):
+            print(exp.with_row_count().join(res.with_row_count(), on="row_nr", suffix="_parse_trace").filter(
+                (pl.col("ts") != pl.col("ts_parse_trace")) | (pl.col("flows") != pl.col("flows_parse_trace"))).head(10))
+
+upcalls = result[2].select(expected[2].columns)
+if not upcalls.frame_equal(expected[2]):
+    same = False
+    print(f"upcalls differ: {len(expected[2])} rows in the baseline, {len(upcalls)} in parse_trace")
+
+print(f"baseline (row by row): {baseline_sec:.3f}s")
+print(f"parse_trace: {parse_sec:.3f}s ({baseline_sec / parse_sec:.1f}x)")
+print("same result" if same else "DIFFERENT results")
+exit(0 if same else 1)
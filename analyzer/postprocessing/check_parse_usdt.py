@@ -0,0 +1,52 @@
+import sys
+import time
+import polars as pl
+from parsing import parse_usdt
+
+
+if len(sys.argv) != 2:
+    print("missing argument: [ovs-vswitchd-usdt csv]")
+    exit(1)
+
+
+# compares parse_usdt with the three-pass filtering it had before the interval table, and prints what the table costs
+REPEATS = 5
+
+
+def baseline_parse_usdt(filename):
+    """
+    parse_usdt as it was before the interval table, kept as the reference
+    """
+    df = pl.read_csv(filename, separator=";", dtypes={"ts": pl.Int64, "flow_limit": pl.Int64, "duration_ns": pl.Int64, "flows": pl.Int64, "tid": pl.Int64})
+    flow_limits = df.lazy().filter(pl.col("probe") == "new_flow_limit").drop("probe").collect()
+    barriers = df.lazy().filter(pl.col("probe") != "new_flow_limit").filter(pl.col("probe").str.starts_with("ovs_").is_not()).filter(pl.col("duration_ns") != pl.col("ts")).drop("flow_limit").drop("flows").with_columns((pl.col("duration_ns").cast(pl.Float64) / 1_000_000_000).alias("duration_sec")).collect()
+    kernel = df.lazy().filter(pl.col("probe").str.starts_with("ovs_")).drop("flow_limit").drop("flows").with_columns((pl.col("duration_ns").cast(pl.Float64) / 1_000_000_000).alias("duration_sec")).collect()
+    return flow_limits, barriers, kernel
+
+
+def timed(f, *args):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = f(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+filename = sys.argv[1]
+# without the Parquet cache of parsing.cached
+expected, baseline_sec = timed(baseline_parse_usdt, filename)
+result, parse_sec = timed(parse_usdt.__wrapped__, filename)
+
+same = True
+for name, exp, res in zip(["flow limits", "barriers", "kernel"], expected, result):
+    if not res.frame_equal(exp):
+        same = False
+        print(f"{name} differ: {len(exp)} rows in the baseline, {len(res)} in parse_usdt")
+
+intervals = result[3]
+print(f"{len(intervals)} revalidator intervals, {intervals.get_column('start').null_count()} loops without a recorded start")
+print(f"baseline, without the intervals: {baseline_sec:.3f}s")
+print(f"parse_usdt, with the intervals: {parse_sec:.3f}s (+{parse_sec - baseline_sec:.3f}s)")
+print("same result" if same else "DIFFERENT results")
+exit(0 if same else 1)
@@ -3,27 +3,24 @@ from matplotlib import pyplot as plt
 import glob
 import numpy as np
 import polars as pl
-from parsing import normalize_ts, parse_dpctl_dump, parse_icmp_rtt, parse_loadavg, parse_trace, parse_udp_rr, parse_usdt, parse_vswitchd, remove_offset_and_scale, renumber, window_frequency
+from parsing import ExperimentTimeline, follow_packet_flood, load_packet_flood, remove_offset_and_scale, renumber, shade_lossy_intervals, window_rates
 
 
+# seconds between the refreshes of the figure with --follow
+FOLLOW_INTERVAL = 5
+
+# --follow plots a running experiment, re-reading only what was appended to its files
+follow = "--follow" in sys.argv
+if follow:
+    sys.argv.remove("--follow")
+
 if len(sys.argv) != 3:
-    print("missing argument: [name of input csv] [name of the output file]")
+    print("missing argument: [--follow] [name of input csv] [name of the output file]")
     exit(1)
 
 
 d = sys.argv[1]
 print(f"Source data: {d}")
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered = parse_trace(glob.glob(f"{d}/kernel_flow_table_trace_*")[0])
-vswitchd = parse_vswitchd(glob.glob(f"{d}/vswitchd*.csv")[0])
-udp_rtt_latencies, udp_rtt_dropped = parse_udp_rr(glob.glob(f"{d}/udp_rr*csv")[0])
-icmp_lat, icmp_err = parse_icmp_rtt(glob.glob(f"{d}/icmp_rtt*.csv")[0])
-usdt_flow_limit, usdt_barriers, kernel_lock = parse_usdt(glob.glob(f"{d}/ovs-vswitchd-usdt*.csv")[0])
-dpctl_log = parse_dpctl_dump(glob.glob(f"{d}/log_ovs_dpctl_show*.csv")[0])
-loadavg = parse_loadavg(glob.glob(f"{d}/loadavg*.csv")[0])
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, dpctl_log, loadavg = normalize_ts(trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, dpctl_log, loadavg)
-
-
-print("Data loading finished, rendering plots...")
 
 
 # figure based on time
@@ -34,43 +31,74 @@ ax3: plt.Axes
 ax4: plt.Axes
 ax, ax2, ax3 = fig.subplots(3, 1, sharex=True, height_ratios=(5,5,2))
 
-# upcalls plot
-fr = window_frequency(trace_upcalls, 0.1)
 
-# resources
-ax3.plot(vswitchd["ts"], vswitchd["vswitchd_rss_bytes"] / 2**30, label="ovs-vswitchd RSS GiB", color="green")
-ax3.plot(loadavg["ts"], loadavg["loadavg1"], label="load average (1min)")
+def plot(frames, seconds):
+    """
+    `seconds` converts the ns timestamps of the frames to seconds since the start of the experiment
+    """
+    trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, usdt_intervals, dpctl_log, loadavg, tracer_drops = frames
+    for a in fig.axes:
+        a.clear()
+
+    # upcalls plot
+    fr = window_rates(trace_upcalls, (0.1,))
+
+    # resources
+    ax3.plot(seconds(vswitchd["ts"]), vswitchd["vswitchd_rss_bytes"] / 2**30, label="ovs-vswitchd RSS GiB", color="green")
+    ax3.plot(seconds(loadavg["ts"]), loadavg["loadavg1"], label="load average (1min)")
 
 
-# latencies
-# UDP packets
-ax2.set_ylabel("ms")
-ax2.set_yticks([0,2000,4000, 6000, 8000])
-ax2.scatter(udp_rtt_latencies["ts"], udp_rtt_latencies["latency_ns"] / 1000000, label="UDP packet RTT", marker=".", color="green", alpha=0.5, linewidths=0)
-ax2.hlines(udp_rtt_latencies["latency_ns"] / 1000000, udp_rtt_latencies['ts'], udp_rtt_latencies['ts'] + udp_rtt_latencies['latency_ns'].cast(pl.Float64) / 1_000_000_000, color="green", alpha=0.1, label="UDP packet in-flight time")
-ax2.scatter(udp_rtt_dropped["ts"], udp_rtt_dropped["ts"]*0 - 1_000, label="dropped UDP packets", marker="x", color="green", alpha=0.5)
-# ICMP
-ax2.scatter(icmp_lat["ts"], icmp_lat["latency_ns"] / 1000000, label="ICMP RTT (ping cmd)", marker=".", color="purple", alpha=0.5, linewidths=0)
-ax2.hlines(icmp_lat["latency_ns"] / 1000000, icmp_lat['ts'], icmp_lat['ts'] + icmp_lat['latency_ns'].cast(pl.Float64) / 1_000_000_000, color="purple", alpha=0.1, label="ICMP packet in-flight time")
-ax2.scatter(icmp_err["ts"], icmp_err["ts"] * 0 - 2_000, label="ping cmd error", marker="x", color="purple", alpha=0.5)
+    # latencies
+    # UDP packets
+    ax2.set_ylabel("ms")
+    ax2.set_yticks([0,2000,4000, 6000, 8000])
+    ax2.scatter(seconds(udp_rtt_latencies["ts"]), udp_rtt_latencies["latency_ns"] / 1000000, label="UDP packet RTT", marker=".", color="green", alpha=0.5, linewidths=0)
+    ax2.hlines(udp_rtt_latencies["latency_ns"] / 1000000, seconds(udp_rtt_latencies['ts']), seconds(udp_rtt_latencies['ts']) + udp_rtt_latencies['latency_ns'].cast(pl.Float64) / 1_000_000_000, color="green", alpha=0.1, label="UDP packet in-flight time")
+    ax2.scatter(seconds(udp_rtt_dropped["ts"]), udp_rtt_dropped["ts"]*0 - 1_000, label="dropped UDP packets", marker="x", color="green", alpha=0.5)
+    # ICMP
+    ax2.scatter(seconds(icmp_lat["ts"]), icmp_lat["latency_ns"] / 1000000, label="ICMP RTT (ping cmd)", marker=".", color="purple", alpha=0.5, linewidths=0)
+    ax2.hlines(icmp_lat["latency_ns"] / 1000000, seconds(icmp_lat['ts']), seconds(icmp_lat['ts']) + icmp_lat['latency_ns'].cast(pl.Float64) / 1_000_000_000, color="purple", alpha=0.1, label="ICMP packet in-flight time")
+    ax2.scatter(seconds(icmp_err["ts"]), icmp_err["ts"] * 0 - 2_000, label="ping cmd error", marker="x", color="purple", alpha=0.5)
 
 
-# flow table
-#ax.plot(trace_table['ts'], trace_table['flows'], label="flow table size")
-ax.plot(fr['mts'], fr['freq'], label="upcalls per second (100ms window)", color="C1")
-ax.plot(dpctl_log['ts'], dpctl_log['flows'], label="flow table size (#entries)", color="C0")
-ax.scatter(usdt_flow_limit['ts'], usdt_flow_limit['flow_limit'], label="flow limit (ovs-vswitchd)", color="C3", marker=".")
-ax.hlines(usdt_flow_limit['flow_limit'][:-1], (usdt_flow_limit['ts'] - usdt_flow_limit['duration_ns'].cast(pl.Float64) / 1_000_000_000)[1:], usdt_flow_limit['ts'][1:], linewidth=0.5, color="C3", label="revalidator loop duration")
+    # flow table
+    #ax.plot(trace_table['ts'], trace_table['flows'], label="flow table size")
+    ax.plot(seconds(fr["ts"]), fr["rate_100ms"], label="upcalls per second (100ms window)", color="C1")
+    ax.plot(seconds(dpctl_log['ts']), dpctl_log['flows'], label="flow table size (#entries)", color="C0")
+    ax.scatter(seconds(usdt_flow_limit['ts']), usdt_flow_limit['flow_limit'], label="flow limit (ovs-vswitchd)", color="C3", marker=".")
+    revalidate = usdt_intervals.filter(pl.col("phase") == "revalidate")
+    ax.hlines(usdt_flow_limit['flow_limit'][:-1], seconds(revalidate['start'][1:]), seconds(revalidate['end'][1:]), linewidth=0.5, color="C3", label="revalidator loop duration")
 
 
-ax.legend(loc='upper right')
-ax.set_ylim((-1000, 70_000))
-ax2.legend(loc='upper left')
-ax3.legend(loc='upper left')
-#fig.tight_layout()
+    shade_lossy_intervals(ax, tracer_drops.with_columns(seconds(pl.col("ts"))))
+    ax.legend(loc='upper right')
+    ax.set_ylim((-1000, 70_000))
+    ax2.legend(loc='upper left')
+    ax3.legend(loc='upper left')
+    #fig.tight_layout()
 
 fig.subplots_adjust(hspace=0)
 
 
-plt.savefig(sys.argv[2], bbox_inches="tight")
-#plt.show()
\ No newline at end of file
+if not follow:
+    frames = load_packet_flood(d, normalize=False)
+    timeline = ExperimentTimeline.of(*frames)
+    print("Data loading finished, rendering plots...")
+    plot(frames, timeline.seconds)
+    plt.savefig(sys.argv[2], bbox_inches="tight")
+    #plt.show()
+    exit(0)
+
+with pl.StringCache():
+    refresh = follow_packet_flood(d)
+    while True:
+        frames = refresh()
+        if frames is None:
+            print("waiting for data in all files...")
+        else:
+            # follow_packet_flood already returns the frames in seconds
+            plot(frames, lambda ts: ts)
+            plt.savefig(sys.argv[2], bbox_inches="tight")
+            print(f"refreshed {sys.argv[2]}")
+        # keeps an interactive window responsive, sleeps otherwise
+        plt.pause(FOLLOW_INTERVAL)
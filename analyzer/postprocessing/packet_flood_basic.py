@@ -3,7 +3,7 @@ from matplotlib import pyplot as plt
 import glob
 import numpy as np
 import polars as pl
-from parsing import normalize_ts, parse_dpctl_dump, parse_icmp_rtt, parse_loadavg, parse_trace, parse_udp_rr, parse_usdt, parse_vswitchd, remove_offset_and_scale, renumber, window_frequency
+from parsing import ExperimentTimeline, load_packet_flood, remove_offset_and_scale, renumber, shade_lossy_intervals, window_rates
 
 
 if len(sys.argv) != 3:
@@ -13,14 +13,9 @@ if len(sys.argv) != 3:
 
 d = sys.argv[1]
 print(f"Source data: {d}")
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered = parse_trace(glob.glob(f"{d}/kernel_flow_table_trace_*")[0])
-vswitchd = parse_vswitchd(glob.glob(f"{d}/vswitchd*.csv")[0])
-udp_rtt_latencies, udp_rtt_dropped = parse_udp_rr(glob.glob(f"{d}/udp_rr*csv")[0])
-icmp_lat, icmp_err = parse_icmp_rtt(glob.glob(f"{d}/icmp_rtt*.csv")[0])
-usdt_flow_limit, usdt_barriers, kernel_lock = parse_usdt(glob.glob(f"{d}/ovs-vswitchd-usdt*.csv")[0])
-dpctl_log = parse_dpctl_dump(glob.glob(f"{d}/log_ovs_dpctl_show*.csv")[0])
-loadavg = parse_loadavg(glob.glob(f"{d}/loadavg*.csv")[0])
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, dpctl_log, loadavg = normalize_ts(trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, dpctl_log, loadavg)
+trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, usdt_intervals, dpctl_log, loadavg, tracer_drops = frames = load_packet_flood(d, normalize=False)
+# the frames keep their ns timestamps, they are converted to seconds only for plotting
+timeline = ExperimentTimeline.of(*frames)
 
 
 print("Data loading finished, rendering plots...")
@@ -35,19 +30,20 @@ ax4: plt.Axes
 ax, ax2, ax4 = fig.subplots(3, 1, sharex=True, height_ratios=(6,2,2))
 
 # upcalls plot
-fr = window_frequency(trace_upcalls, 0.1)
+fr = window_rates(trace_upcalls, (0.1,))
 
 # resources
 #ax2.scatter(vswitchd["ts"], vswitchd["vswitchd_threads"] * 10000, label="vswitchd threads * 10000", color="green", marker=".")
-ax2.plot(vswitchd["ts"], vswitchd["vswitchd_rss_bytes"] / 2**20, label="ovs-vswitchd RSS in MiB", color="green")
+ax2.plot(timeline.seconds(vswitchd["ts"]), vswitchd["vswitchd_rss_bytes"] / 2**20, label="ovs-vswitchd RSS in MiB", color="green")
 
-ax4.plot(loadavg["ts"], loadavg["loadavg1"], label="load average (1min)")
+ax4.plot(timeline.seconds(loadavg["ts"]), loadavg["loadavg1"], label="load average (1min)")
 
 # flow table size
 #ax.plot(trace_table['ts'], trace_table['flows'], label="flow table size")
-ax.plot(fr['mts'], fr['freq'], label="upcalls per second (100ms window)", color="C1")
-ax.plot(dpctl_log['ts'], dpctl_log['flows'], label="flow table size (#entries)", color="C0")
+ax.plot(timeline.seconds(fr["ts"]), fr["rate_100ms"], label="upcalls per second (100ms window)", color="C1")
+ax.plot(timeline.seconds(dpctl_log['ts']), dpctl_log['flows'], label="flow table size (#entries)", color="C0")
 
+shade_lossy_intervals(ax, timeline.normalized(tracer_drops))
 ax.legend(loc='upper left')
 ax2.legend(loc='upper left')
 ax4.legend(loc='upper left')
@@ -4,8 +4,8 @@ from matplotlib import patches as mpatches
 import glob
 import numpy as np
 import polars as pl
-from parsing import normalize_ts, parse_dpctl_dump, parse_icmp_rtt, parse_loadavg, parse_trace, parse_udp_rr, parse_usdt, parse_vswitchd, remove_offset_and_scale, renumber, window_frequency
-from window import rolling_window_left
+from parsing import Experiment, parse_drops, shade_lossy_intervals, window_rates
+from window import rolling_quantiles
 
 
 if len(sys.argv) != 3:
@@ -15,14 +15,10 @@ if len(sys.argv) != 3:
 
 d = sys.argv[1]
 print(f"Source data: {d}")
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered = parse_trace(glob.glob(f"{d}/kernel_flow_table_trace_*")[0])
-vswitchd = parse_vswitchd(glob.glob(f"{d}/vswitchd*.csv")[0])
-udp_rtt_latencies, udp_rtt_dropped = parse_udp_rr(glob.glob(f"{d}/udp_rr*csv")[0])
-icmp_lat, icmp_err = parse_icmp_rtt(glob.glob(f"{d}/icmp_rtt*.csv")[0])
-usdt_flow_limit, usdt_barriers, kernel_lock = parse_usdt(glob.glob(f"{d}/ovs-vswitchd-usdt*.csv")[0])
-dpctl_log = parse_dpctl_dump(glob.glob(f"{d}/log_ovs_dpctl_show*.csv")[0])
-loadavg = parse_loadavg(glob.glob(f"{d}/loadavg*.csv")[0])
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, dpctl_log, loadavg = normalize_ts(trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped, icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, dpctl_log, loadavg)
+exp = Experiment(d)
+
+# lost probes have the maximum as latency
+answered = pl.col("latency_ns") != 0xFFFF_FFFF_FFFF_FFFF
 
 
 STRESSED_INTERVAL = [12, 125]
@@ -36,11 +32,11 @@ def mean_confidence_interval(data, confidence=0.95):
     h = se * scipy.stats.t.ppf((1 + confidence) / 2., n-1)
     return m, m-h, m+h
 print("stressed UDP latency")
-st = udp_rtt_latencies.filter(pl.col("ts").is_between(*STRESSED_INTERVAL))
+st = exp.scan("udp_rr", ["ts", "latency_ns"], between=STRESSED_INTERVAL).filter(answered).collect()
 print(st.describe())
 print(mean_confidence_interval(st['latency_ns']))
 print("non-stressed UDP latencies")
-nst = udp_rtt_latencies.filter(pl.col("ts").is_between(*NON_STRESSED_INTERVAL))
+nst = exp.scan("udp_rr", ["ts", "latency_ns"], between=NON_STRESSED_INTERVAL).filter(answered).collect()
 print(nst.describe())
 print(mean_confidence_interval(nst['latency_ns']))
 
@@ -49,7 +45,11 @@ a = scipy.stats.ttest_ind(st['latency_ns'], nst['latency_ns'], equal_var=False,
 print(a)
 
 
-
+# only the columns and rows that are plotted
+trace_upcalls = exp.upcalls(["ts"]).collect()
+udp_rtt_latencies = exp.scan("udp_rr", ["ts", "latency_ns"]).filter(answered & (pl.col("latency_ns") < 420_000)).collect()
+icmp_lat = exp.scan("icmp_rtt", ["ts", "latency_us"]).filter(pl.col("latency_us") < 420).with_columns(pl.col("latency_us").cast(pl.Float64)).collect()
+tracer_drops = exp.timeline.normalized(parse_drops(exp.log()))
 print("Data loading finished, rendering plots...")
 
 
@@ -62,16 +62,15 @@ ax3: plt.Axes
 ax, ax2, ax3 = fig.subplots(3, 1, sharex=True, height_ratios=(6, 1.5, 0.6))
 
 # upcall frequency
-fr = window_frequency(trace_upcalls, 0.1)
-ax2.plot(fr['ts'] / 1000, fr['freq'], label="upcall frequency (window size 100ms)")
+fr = window_rates(trace_upcalls, (0.1,))
+ax2.plot(fr["ts"], fr["rate_100ms"], label="upcall frequency (window size 100ms)")
 ax2.set_ylabel("Hz")
 ax2.set_yticks([0, 25000, 50000])
 ax2.set_ylim((0,60000))
+shade_lossy_intervals(ax2, tracer_drops)
 ax2.legend(loc='upper right')
 
 # RTTs
-udp_rtt_latencies = udp_rtt_latencies.filter(pl.col("latency_ns") < 420_000 )
-icmp_lat = icmp_lat.filter(pl.col("latency_ns") < 420_000 )
 def median_line(df, lat, width):
     times = []
     medians = []
@@ -79,18 +78,17 @@ def median_line(df, lat, width):
     q75 = []
     wmin = []
     wmax = []
-    for ts_left, values in rolling_window_left(df["ts"], df[lat], width):
-        medians.append(np.median(values))
-        wmin.append(np.quantile(values, 0.05))
-        wmax.append(np.quantile(values, 0.95))
-        q25.append(np.quantile(values, 0.25))
-        q75.append(np.quantile(values, 0.75))
+    for ts_left, (low, lower, median, upper, high) in rolling_quantiles(df["ts"], df[lat], width, (0.05, 0.25, 0.5, 0.75, 0.95)):
+        medians.append(median)
+        wmin.append(low)
+        wmax.append(high)
+        q25.append(lower)
+        q75.append(upper)
         times.append((ts_left + width/2))  # centered
     return times, medians, q25, q75, wmin, wmax
 
 WINDOW = 2 # in micros
 udp_rtt_latencies = udp_rtt_latencies.with_columns((pl.col("latency_ns") / 1000).alias("latency_us"))
-icmp_lat = icmp_lat.with_columns((pl.col("latency_ns") / 1000).alias("latency_us"))
 ts1, med1, q251, q751, min1, max1 = median_line(udp_rtt_latencies, "latency_us", WINDOW)
 ts2, med2, q252, q752, min2, max2 = median_line(icmp_lat, "latency_us", WINDOW)
 
@@ -101,7 +99,7 @@ ax.fill_between(ts2, min2, max2, alpha=0.1, color="C1")
 ax.fill_between(ts2, q252, q752, alpha=0.4, color="C1")
 ax.plot(ts2, med2, label=f"centered {WINDOW}s-window median 2", color="C1")
 ax.scatter(udp_rtt_latencies["ts"], udp_rtt_latencies["latency_ns"] / 1_000, label="UDP packet RTT", linewidths=0, s=1, color="C0", alpha=0.8)
-ax.scatter(icmp_lat["ts"], icmp_lat["latency_ns"] / 1_000, label="ICMP RTT (ping cmd)", linewidths=0, s=1, color="C1", alpha=0.8)
+ax.scatter(icmp_lat["ts"], icmp_lat["latency_us"], label="ICMP RTT (ping cmd)", linewidths=0, s=1, color="C1", alpha=0.8)
 ax.set_ylabel("μs")
 ax.set_xlabel("seconds")
 ax.set_ylim((70, 300))
@@ -22,7 +22,8 @@ if len(sys.argv) != 3:
 
 d = sys.argv[1]
 print(f"Source data: {d}")
-trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered = parse_trace(glob.glob(f"{d}/kernel_flow_table_trace_*")[0])
+tracer_log = glob.glob(f"{d}/trace_log*.jsonl")[0]
+trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered = parse_trace(glob.glob(f"{d}/kernel_flow_table_trace_*")[0], tracer_log)
 #packets_hist = parse_pcap(glob.glob(f"{d}/packet_capture_*.pcap")[0])
 tags = parse_tags(glob.glob(f"{d}/tags*.jsonl")[0])
 dpctl_log = parse_dpctl_dump(glob.glob(f"{d}/log_ovs_dpctl_show*.csv")[0])
@@ -1,143 +1,578 @@
 
+import functools
+import glob
+import gzip
+import hashlib
+import inspect
+import io
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import time
+import numpy as np
 import polars as pl
-from typing import List, Optional, Tuple, Type, TypeVar
-from pydantic import BaseModel
-from scapy import *
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
 
-def parse_trace(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+# parsed frames are cached as Parquet in this directory next to the raw files, set PARSING_CACHE=0 to bypass it
+CACHE_DIR = ".parsing_cache"
+# bump when a cached parse_* function changes its output
+CACHE_VERSION = 5
+
+def file_hash(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_key(filename: str) -> dict:
+    stat = os.stat(filename)
+    return {"file": os.path.basename(filename), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_hash(filename)}
+
+# a cache entry left broken by an interrupted run, or by an older version, is a cache miss
+CACHE_READ_ERRORS = (OSError, ValueError, KeyError, TypeError, pl.exceptions.ArrowError, pl.exceptions.ComputeError)
+
+def replace_file(filename: str, write: Callable[[str], None]):
+    """
+    `write(path)` to a temporary file that is then renamed to `filename`, so that the file is complete or not there
+    """
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+def file_unchanged(key: dict, filename: str) -> bool:
+    stat = os.stat(filename)
+    if key["file"] != os.path.basename(filename) or key["size"] != stat.st_size:
+        return False
+    # copies and rsync without -t touch the mtime, compare the content then
+    return key["mtime_ns"] == stat.st_mtime_ns or key["sha256"] == file_hash(filename)
+
+def cached(parse):
+    """
+    cache the frame(s) returned by `parse(filename, *args, **kwargs)` in `CACHE_DIR`
+
+    the cache is keyed by the size, mtime and content hash of the input files (`filename` with all its
+    parts and other arguments naming files) and by the other arguments, so it survives moving the results directory.
+    arguments count the same given by position, by keyword or left at their default.
+    content given as bytes instead of a file name (by the `Followed*` readers) is not cached
+    """
+    signature = inspect.signature(parse)
+
+    @functools.wraps(parse)
+    def wrapper(filename: Union[str, bytes], *args, **kwargs):
+        if os.environ.get("PARSING_CACHE") == "0" or not isinstance(filename, str):
+            return parse(filename, *args, **kwargs)
+
+        bound = signature.bind(filename, *args, **kwargs)
+        bound.apply_defaults()
+        args = list(bound.arguments.values())[1:]
+        inputs = trace_parts(filename) + [arg for arg in args if isinstance(arg, str) and os.path.isfile(arg)]
+        params = json.dumps([CACHE_VERSION, [os.path.basename(arg) if isinstance(arg, str) else arg for arg in args]])
+        name = f"{os.path.basename(trace_base(filename))}.{parse.__name__}.{hashlib.sha256(params.encode()).hexdigest()[:12]}"
+        cache = os.path.join(os.path.dirname(filename), CACHE_DIR, name)
+
+        try:
+            with open(cache + ".json") as f:
+                key = json.load(f)
+            if len(key["inputs"]) == len(inputs) and all(file_unchanged(k, i) for k, i in zip(key["inputs"], inputs)):
+                frames = tuple(pl.read_parquet(f"{cache}.{i}.parquet") for i in range(key["frames"]))
+                return frames if key["tuple"] else frames[0]
+        except CACHE_READ_ERRORS:
+            pass
+
+        result = parse(*bound.args, **bound.kwargs)
+        frames = result if isinstance(result, tuple) else (result,)
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        # the key goes last, a cache entry without it is never used
+        if os.path.exists(cache + ".json"):
+            os.unlink(cache + ".json")
+        try:
+            for i, frame in enumerate(frames):
+                replace_file(f"{cache}.{i}.parquet", frame.write_parquet)
+        except Exception as e:
+            # not everything in a frame fits into Parquet (object columns), such results are not cached
+            print(f"not caching {name}: {e}")
+            return result
+        key = {"inputs": [file_key(i) for i in inputs], "frames": len(frames), "tuple": isinstance(result, tuple)}
+
+        def write_key(path):
+            with open(path, "w") as f:
+                json.dump(key, f)
+        replace_file(cache + ".json", write_key)
+        return result
+
+    return wrapper
+
+
+def open_trace(filename: str) -> io.BufferedIOBase:
+    """
+    open a file written by the tracer for binary reading, decompressing according to the suffix of `log_flow_ops.py --compress`
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    elif filename.endswith(".zst"):
+        import zstandard
+        with open(filename, "rb") as f:
+            return io.BytesIO(zstandard.ZstdDecompressor().stream_reader(f).read())
+    elif filename.endswith(".lz4"):
+        import lz4.frame
+        return lz4.frame.open(filename, "rb")
+    return open(filename, "rb")
+
+def read_available(f: io.BufferedIOBase) -> bytes:
+    """
+    the content of a trace file, up to where it was cut off when the tracer didn't exit cleanly. a compressed part
+    then ends without its end-of-stream marker, what was decompressed before that is kept
+    """
+    chunks = []
+    try:
+        while chunk := f.read(1 << 16):
+            chunks.append(chunk)
+    except EOFError:
+        pass
+    return b"".join(chunks)
+
+def is_compressed(filename: str) -> bool:
+    return re.search(r"\.(gz|zst|lz4)$", filename) is not None
+
+def trace_input(filename: str) -> Union[str, bytes]:
+    """
+    what to give to the polars readers, the path if not compressed and the decompressed content otherwise
+    """
+    if not is_compressed(filename):
+        return filename
+    with open_trace(filename) as f:
+        data = read_available(f)
+    # the tracer ends every line, anything after the last newline is from a part that was cut off
+    return data[:data.rfind(b"\n") + 1]
+
+def trace_base(filename: str) -> str:
+    """
+    file name of a trace as given to the tracer, without part number, manifest or compression suffix
+    """
+    base = re.sub(r"\.(gz|zst|lz4)$", "", filename)
+    base = base.removesuffix(".manifest.json")
+    return re.sub(r"\.\d+$", "", base)
+
+def trace_parts(filename: str) -> List[str]:
+    """
+    all files of a trace in order, rotated or compressed traces (`FILE.000.gz`, ... and `FILE.manifest.json`)
+    can be given by any of their files
+    """
+    manifest = trace_base(filename) + ".manifest.json"
+    if not os.path.exists(manifest):
+        return [filename]
+    with open(manifest) as f:
+        parts = json.load(f)["parts"]
+    return [os.path.join(os.path.dirname(manifest), part["file"]) for part in parts]
+
+def trace_format(filename: str) -> str:
+    """
+    "bin", "csv" or "jsonl", told by the first line of the trace and not by its name, node_logger names the events
+    file `.csv` whatever the format. binary traces start with a JSON header that has the record layout
+    """
+    with open_trace(trace_parts(filename)[0]) as f:
+        first = f.readline()
+    if first.startswith(b"{"):
+        return "bin" if "record_size" in json.loads(first) else "jsonl"
+    return "csv"
+
+def read_binary_trace(filename: str) -> pl.DataFrame:
+    """
+    load events written by `log_flow_ops.py --format bin`
+
+    the first line of the file is a JSON header describing the layout of the raw records
+    """
+    with open_trace(filename) as f:
+        header = json.loads(f.readline())
+        names, offsets, formats = zip(*header["fields"])
+        dtype = np.dtype({"names": names, "offsets": offsets, "formats": formats, "itemsize": header["record_size"]})
+        data = read_available(f)
+    # a record at the end of a part that was cut off is incomplete
+    records = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+
+    columns = {}
+    for name in names:
+        if name == "event":
+            columns[name] = np.array(header["events"])[records[name]]
+        elif records.dtype[name].kind == "S":
+            columns[name] = np.char.decode(records[name], errors="ignore")
+        else:
+            columns[name] = records[name].astype(np.int64)
+    return pl.DataFrame(columns)
+
+def read_trace_metadata(filename: str) -> dict:
+    """
+    metadata stored by the tracer, JSON header of binary traces and `# key=value` lines at the start of CSV traces
+    """
+    filename = trace_parts(filename)[0]
+    if trace_format(filename) == "bin":
+        with open_trace(filename) as f:
+            return json.loads(f.readline())
+
+    with open_trace(filename) as f:
+        return parse_metadata_lines(io.TextIOWrapper(f))
+
+def parse_metadata_lines(lines: Iterable[str]) -> dict:
+    """
+    the `# key=value` lines at the start of a CSV trace, up to the first other line
+    """
+    metadata = {}
+    for line in lines:
+        if not line.startswith("#"):
+            break
+        key, value = line[1:].strip().split("=", 1)
+        metadata[key] = json.loads(value)
+    return metadata
+
+# columns of traces written with `--aggregate-ms`, they have the same file names as event traces
+AGGREGATED_COLUMNS = {"duration_ns", "count"}
+
+def check_event_trace(filename: str, columns: List[str]):
+    """
+    refuse aggregated traces where events are expected, each of their rows is a time bucket and not one event
+    """
+    assert not AGGREGATED_COLUMNS <= set(columns), f"{filename} was recorded with --aggregate-ms, load it with parse_aggregated_trace"
+
+# flow count changes of the trace events, the count restarts from 0 after a flush
+TABLE_CHANGE = {
+    "TABLE_FLUSH": 0,
+    "TABLE_REMOVE": -1,
+    "TABLE_INSERT": 1,
+}
+
+CMD_CHANGE = {
+    "CMD_NEW": 1,
+    "CMD_DEL": -1,
+    "CMD_SET": 0,
+}
+
+def flow_events(trace: pl.DataFrame, deltas: dict, initial: int = 0) -> pl.DataFrame:
+    """
+    the events of `deltas` with the flow count after each of them
+
+    newer traces have the flow count maintained in kernel, older ones need it reconstructed as a running sum
+    of the changes, restarting at each flush. `initial` is the count before the first event
+    """
+    events = trace.filter(pl.col("event").is_in(list(deltas.keys())))
+    if "flows" not in trace.columns:
+        flows = pl.col("event").map_dict(deltas).cumsum().over("segment")
+        if initial:
+            flows = flows + pl.when(pl.col("segment") == 0).then(initial).otherwise(0)
+        events = events.with_columns((pl.col("event") == "TABLE_FLUSH").cumsum().alias("segment")) \
+                       .with_columns(flows.alias("flows"))
+    return events
+
+def flow_steps(events: pl.DataFrame, initial: int = 0) -> pl.DataFrame:
+    """
+    turn events with the flow count after each of them into a step series,
+    every event gets a point just before it (`ts - 1`) and one at `ts`, `initial` is the count before the first event
+    """
+    events = events.select([pl.col("ts").cast(pl.Int64), pl.col("flows").cast(pl.Int64)]).with_row_count("i").with_columns(pl.col("i").cast(pl.Int64))
+    before = events.select([pl.col("i") * 2, pl.col("ts") - 1, pl.col("flows").shift(1).fill_null(initial)])
+    after = events.select([pl.col("i") * 2 + 1, pl.col("ts"), pl.col("flows")])
+    return pl.concat([before, after]).sort("i").drop("i")
+
+def trace_upcalls(trace: pl.DataFrame, comms: pl.DataFrame, sample_rate: int = 1) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    return values:
+        1. upcall events, with the command names from `comms` if the trace doesn't have them
+        2. upcalls of the experiment's own processes
+
+    each upcall of a sampled trace stands for `sample_rate` of them, given in the added `weight` column
+    """
+    upcalls = trace.filter(pl.col("event") == "UPCALL")
+    if "comm" not in upcalls.columns:
+        # a pid can have had several names, each upcall gets the one it had at the time
+        upcalls = upcalls.with_row_count("row").sort("ts").join_asof(comms.sort("since"), left_on="ts", right_on="since", by="pid") \
+                         .sort("row").drop(["row", "since"])
+    if sample_rate > 1:
+        upcalls = upcalls.with_columns(pl.lit(sample_rate, dtype=pl.Int64).alias("weight"))
+    return upcalls, upcalls.filter(pl.col("comm").is_in(("python3", "analyzer")))
+
+@cached
+def parse_trace(filename: str, log: Optional[str] = None) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    newer traces don't contain the command names, they are taken from the tracer log if given
+
+    compressed and rotated traces are read whole, `filename` can be any of their files
+    """
     # backwards compatible file loading
-    if filename.endswith("csv"):
-        trace = pl.read_csv(filename)
-    elif filename.endswith("jsonl"):
-        trace = pl.read_ndjson(filename)
+    parts = trace_parts(filename)
+    fmt = trace_format(filename)
+    if fmt == "csv":
+        trace = pl.concat([pl.read_csv(trace_input(part), comment_char="#") for part in parts])
+    elif fmt == "jsonl":
+        trace = pl.concat([pl.read_ndjson(trace_input(part)) for part in parts])
     else:
-        assert False, "unexpected file extension"
+        trace = pl.concat([read_binary_trace(part) for part in parts])
+    check_event_trace(filename, trace.columns)
 
-    cmd_change = {
-        "CMD_NEW": lambda s: s + 1,
-        "CMD_DEL": lambda s: s - 1,
-        "CMD_SET": lambda s: s,
-    }
+    comms = parse_comms(log) if log is not None and "comm" not in trace.columns else EMPTY_COMMS
+    upcalls, filtered = trace_upcalls(trace, comms, read_trace_metadata(filename).get("sample_rate", 1))
 
-    table_change = {
-        "TABLE_FLUSH": lambda s: 0,
-        "TABLE_REMOVE": lambda s: s - 1,
-        "TABLE_INSERT": lambda s: s + 1,
-    }
+    return (flow_steps(flow_events(trace, TABLE_CHANGE)), flow_steps(flow_events(trace, CMD_CHANGE)), upcalls, filtered)
 
+def scan_trace(filename: str) -> pl.LazyFrame:
+    """
+    events of a trace as a LazyFrame, without the flow count reconstruction and command names of `parse_trace`
 
-    def process(vtable):
-        n_flows = 0
-        ts = []
-        flows = []
-        keys = vtable.keys()
-        
-        for row in trace.filter(trace["event"].is_in(keys)).iter_rows(named=True):
-            ts.append(row['ts']-1)
-            flows.append(n_flows)
-            
-            # we must be sure that the event is always there
-            n_flows = vtable[row["event"]](n_flows)
+    only uncompressed CSV is scanned lazily, other formats are read whole first
+    """
+    parts = []
+    fmt = trace_format(filename)
+    for part in trace_parts(filename):
+        if fmt == "csv" and not is_compressed(part):
+            parts.append(pl.scan_csv(part, comment_char="#"))
+        elif fmt == "csv":
+            parts.append(pl.read_csv(trace_input(part), comment_char="#").lazy())
+        elif fmt == "bin":
+            parts.append(read_binary_trace(part).lazy())
+        else:
+            parts.append(pl.read_ndjson(trace_input(part)).lazy())
+    check_event_trace(filename, parts[0].columns)
+    return pl.concat(parts)
 
-            ts.append(row["ts"])
-            flows.append(n_flows)
+@cached
+def parse_aggregated_trace(filename: str) -> pl.DataFrame:
+    """
+    load trace recorded with `log_flow_ops.py --aggregate-ms N`, one row per event type and time bucket
 
-        return pl.DataFrame({"ts": ts, "flows": flows})
+    the added column `freq` is the event rate within the bucket in Hz
+    """
+    trace = pl.concat([pl.read_csv(trace_input(part), dtypes={"ts": pl.Int64, "duration_ns": pl.Int64, "count": pl.Int64}) for part in trace_parts(filename)])
+    return trace.sort("ts").with_columns((pl.col("count") / (pl.col("duration_ns").cast(pl.Float64) / 1_000_000_000)).alias("freq"))
 
+def parse_log_records(filename: Union[str, bytes], event: str) -> list[dict]:
+    """
+    records of one type from the tracer log (`trace_log_*.jsonl`), the record types have different fields
 
-    upcalls = trace.filter(trace["event"] == "UPCALL")
-    filtered = upcalls.filter(upcalls["comm"].is_in(("python3", "analyzer")))
+    the log can also be given as its content
+    """
+    if isinstance(filename, bytes):
+        records = [json.loads(line) for line in filename.splitlines() if line.strip()]
+    else:
+        with open(filename) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    return [r for r in records if r["event"] == event]
 
-    return (process(table_change), process(cmd_change), upcalls, filtered)
+COMMS_SCHEMA = {"pid": pl.Int64, "since": pl.Int64, "comm": pl.Utf8}
+EMPTY_COMMS = pl.DataFrame(schema=COMMS_SCHEMA)
 
+def parse_comms(filename: Union[str, bytes]) -> pl.DataFrame:
+    """
+    pid -> command name table from the tracer log (`trace_log_*.jsonl`), with the timestamp (ns) of the first event
+    under each name in `since`. pids are reused and threads renamed, so a pid can have several rows
+    """
+    rows = []
+    for record in parse_log_records(filename, "COMMS"):
+        # older tracers logged a single name per pid
+        since = record.get("since", {})
+        rows.extend((int(pid), since.get(pid, 0), comm) for pid, comm in record["comms"].items())
+    return pl.DataFrame(rows, schema=COMMS_SCHEMA, orient="row").unique(["pid", "since"], keep="last", maintain_order=True)
+
+def parse_tracer_summary(filename: str) -> dict:
+    """
+    the final LOG record of the tracer log (`trace_log_*.jsonl`)
+    """
+    return parse_log_records(filename, "LOG")[-1]
+
+@cached
+def parse_latency_histograms(filename: str) -> pl.DataFrame:
+    """
+    load histograms written by `log_flow_ops.py --latency-histograms` into the tracer log
+
+    one row per interval, probe and log2 slot. The slot counts durations from `lower_ns` (inclusive)
+    to `2 * lower_ns` (exclusive), slot 0 contains zero-length durations.
+    """
+    rows = []
+    for record in parse_log_records(filename, "HISTOGRAM"):
+        for slot, count in enumerate(record["slots"]):
+            if count > 0:
+                rows.append((record["ts"], record["interval_ns"], record["probe"], slot, count))
+
+    df = pl.DataFrame(rows, schema=[("ts", pl.Int64), ("interval_ns", pl.Int64), ("probe", pl.Utf8), ("slot", pl.Int64), ("count", pl.Int64)])
+    return df.with_columns(pl.when(pl.col("slot") == 0).then(0).otherwise(pl.lit(2).pow(pl.col("slot") - 1)).cast(pl.Int64).alias("lower_ns"))
+
+@cached
+def parse_drops(filename: str) -> pl.DataFrame:
+    """
+    load the time series of events dropped by the tracer from its log (`trace_log_*.jsonl`)
+
+    one row per interval ending at `ts`, with the total in `drops` and a column per event type
+    """
+    records = parse_log_records(filename, "DROPS")
+    df = pl.DataFrame({
+        "ts": [r["ts"] for r in records],
+        "interval_ns": [r["interval_ns"] for r in records],
+    }, schema={"ts": pl.Int64, "interval_ns": pl.Int64})
+    per_type = pl.DataFrame([r["drops"] for r in records]).select(pl.all().cast(pl.Int64))
+    if per_type.width > 0:
+        df = df.hstack(per_type).with_columns(pl.sum(per_type.columns).alias("drops"))
+    else:
+        df = df.with_columns(pl.lit(0, dtype=pl.Int64).alias("drops"))
+    return df
+
+def lossy_intervals(drops: pl.DataFrame) -> list[Tuple[float, float]]:
+    """
+    time intervals in which the tracer dropped events, adjacent intervals are merged
+
+    expects the drops frame already normalized (`ts` in seconds)
+    """
+    intervals = []
+    for ts, interval_ns, count in drops.select(["ts", "interval_ns", "drops"]).iter_rows():
+        if count == 0:
+            continue
+        start = ts - interval_ns / 1_000_000_000
+        if intervals and intervals[-1][1] >= start - 0.001:
+            intervals[-1] = (intervals[-1][0], ts)
+        else:
+            intervals.append((start, ts))
+    return intervals
+
+def shade_lossy_intervals(ax, drops: pl.DataFrame):
+    """
+    shade the `lossy_intervals` of the normalized drops frame on the matplotlib axes `ax`, the tracer lost events
+    there and the upcall rate is unreliable
+    """
+    for i, (start, end) in enumerate(lossy_intervals(drops)):
+        ax.axvspan(start, end, color="red", alpha=0.1, linewidth=0, label="tracer dropped events" if i == 0 else None)
+
+@cached
+def parse_flow_keys(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    load flow keys written by `log_flow_ops.py --flow-keys`
+
+    return values:
+        1. the first upcall of every distinct key
+        2. total upcall counts of keys the tracer still remembered at the end
+    """
+    df = pl.read_csv(filename, dtypes={"ts": pl.Int64, "count": pl.Int64})
+    first = df.filter(pl.col("kind") == "first").drop("kind").drop("count")
+    totals = df.filter(pl.col("kind") == "total").drop("kind").drop("ts")
+    return first, totals
+
+@cached
 def parse_tags(filename: str) -> pl.DataFrame:
     return pl.read_ndjson(filename)
 
-def parse_pcap(filename: str) -> pl.DataFrame:
-    class Pkt(BaseModel):
-        packets_before: int = 0
-        tcpdump_time: float = 0
-
-
-    class Tag(Pkt):
-        tag: str
-
-
-    class Stats(Pkt):
-        ns_monotonic: int
-        lookup_hit: int
-        lookup_missed: int
-        lookup_lost: int
-        flows: int
-        masks_hit: int
-        masks_total: int
-        masks_hit_per_pkt: float
-        cache_hit: int
-        cache_hit_rate: float
-        cache_masks_size: int
-
-        packets_before: int = 0
-        tcpdump_time: EDecimal | float = 0.0
-        delta_cache_hit: int = -1
-        lookup_total: int = -1
-        delta_lookups: int = -1
-        delta_mask_hits: int = -1
-
-    T = TypeVar("T", bound=Pkt)
-    def try_parse(cls: Type[T], pkt: Packet) -> Optional[T]:
-        data = bytes(pkt[UDP].payload)
-        try:
-            res = cls.parse_raw(data.decode('utf8'))
-            res.tcpdump_time = pkt.time
-            return res
-        except Exception as e:
-            return None
+# UDP port the packet fuzzing tags and the flow table stats are sent to
+PCAP_JSON_PORT = 9876
 
+# fields of the flow table stats sent during packet fuzzing, payloads without all of them are ignored
+PCAP_STATS_FIELDS = ["ns_monotonic", "lookup_hit", "lookup_missed", "lookup_lost", "flows", "masks_hit", "masks_total",
+                     "masks_hit_per_pkt", "cache_hit", "cache_hit_rate", "cache_masks_size"]
 
-    # load
-    scapy_cap = PcapReader(filename)
-    stats: list[Stats] = []
-    tags: list[Tag] = []
-    cnt = 0
-    for pkt in scapy_cap:
-        if pkt.haslayer(UDP):
-            s = try_parse(Stats, pkt)
-            if s is not None:
-                s.packets_before = cnt
-                cnt = 0
-                stats.append(s)
-                continue
-            
-            s = try_parse(Tag, pkt)
-            if s is not None:
-                tags.append(s)
-                continue
+# pcap link type -> (offset of the ethertype, offset of the network header), None if there is no ethertype
+PCAP_LINK_TYPES = {
+    1: (12, 14),     # Ethernet
+    101: (None, 0),  # raw IP
+    113: (14, 16),   # Linux cooked capture (tcpdump -i any)
+    276: (0, 20),    # Linux cooked capture v2 (tcpdump -i any)
+}
 
+def pcap_packets(filename: str) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    timestamp (ns), link type and captured bytes of every packet of a pcap file
+
+    plain files are memory-mapped, `.pcap.gz` is decompressed while reading
+    """
+    with open(filename, "rb") as raw:
+        if filename.endswith(".gz"):
+            f = gzip.open(raw, "rb")
+            read = f.read
         else:
-            cnt += 1
+            buf = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+            offset = 0
+            def read(n):
+                nonlocal offset
+                offset += n
+                return buf[offset - n:offset]
 
+        header = read(24)
+        magic = header[:4]
+        order = {b"\xd4\xc3\xb2\xa1": "<", b"\x4d\x3c\xb2\xa1": "<", b"\xa1\xb2\xc3\xd4": ">", b"\xa1\xb2\x3c\x4d": ">"}.get(magic)
+        assert order is not None, f"{filename} is not a pcap file"
+        frac_ns = 1 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1000
+        linktype = struct.unpack(order + "I", header[20:24])[0] & 0x0FFFFFFF
+        record = struct.Struct(order + "IIII")
 
-    # normalize time
-    min_time = min([*tags, *stats], key=lambda p: p.tcpdump_time).tcpdump_time
-    for t in tags:
-        t.tcpdump_time -= min_time
-    for s in stats:
-        s.tcpdump_time -= min_time
+        while len(rec := read(16)) == 16:
+            sec, frac, incl_len, _ = record.unpack(rec)
+            yield sec * 1_000_000_000 + frac * frac_ns, linktype, read(incl_len)
+
+def udp_payload(linktype: int, data: bytes) -> Optional[Tuple[int, bytes]]:
+    """
+    destination port and payload of an IPv4 UDP packet, None for anything else
+    """
+    ethertype_at, ip = PCAP_LINK_TYPES.get(linktype, (None, None))
+    if ip is None:
+        return None
+    if ethertype_at is not None:
+        ethertype = int.from_bytes(data[ethertype_at:ethertype_at + 2], "big")
+        # one 802.1Q tag
+        if ethertype == 0x8100 and ethertype_at == 12:
+            ethertype = int.from_bytes(data[16:18], "big")
+            ip += 4
+        if ethertype != 0x0800:
+            return None
+    if len(data) < ip + 20 or data[ip] >> 4 != 4 or data[ip + 9] != 17:
+        return None
 
-    # calculate custom values
-    for st in stats:
-        st.lookup_total = st.lookup_missed + st.lookup_lost + st.lookup_hit
+    udp = ip + (data[ip] & 0x0F) * 4
+    return int.from_bytes(data[udp + 2:udp + 4], "big"), data[udp + 8:]
 
-    # calculate deltas and other custom values
-    for i,j in zip(range(len(stats)), range(1, len(stats))):
-        stats[j].delta_cache_hit = stats[j].cache_hit - stats[i].cache_hit
-        stats[j].delta_lookups = stats[j].lookup_total - stats[i].lookup_total
-        stats[j].delta_mask_hits = stats[j].masks_hit - stats[i].masks_hit
+@cached
+def parse_pcap(filename: str, port: int = PCAP_JSON_PORT) -> pl.DataFrame:
+    """
+    flow table stats sent over UDP during packet fuzzing, from its tcpdump capture (`.pcap` or `.pcap.gz`)
+
+    only the packet headers are decoded, JSON only for UDP to `port`. `packets_before` counts the non-UDP
+    packets since the previous stats, `tcpdump_time` is in seconds since the first tag or stats packet
+    """
+    rows = []
+    first_ns = None
+    cnt = 0
+    for ts, linktype, data in pcap_packets(filename):
+        udp = udp_payload(linktype, data)
+        if udp is None:
+            cnt += 1
+            continue
+        dport, payload = udp
+        if dport != port:
+            continue
+
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            continue
+        if all(field in msg for field in PCAP_STATS_FIELDS):
+            rows.append([cnt, ts] + [msg[field] for field in PCAP_STATS_FIELDS])
+            cnt = 0
+        elif "tag" not in msg:
+            continue
+        first_ns = ts if first_ns is None else min(first_ns, ts)
 
-    # convert to pandas frame
-    return pl.DataFrame([s.__dict__ for s in stats])
+    df = pl.DataFrame(rows, schema=["packets_before", "tcpdump_time"] + PCAP_STATS_FIELDS, orient="row")
+    return df.with_columns([
+        ((pl.col("tcpdump_time") - first_ns) / 1_000_000_000).alias("tcpdump_time"),
+        (pl.col("lookup_hit") + pl.col("lookup_missed") + pl.col("lookup_lost")).alias("lookup_total"),
+    ]).with_columns([
+        pl.col("cache_hit").diff().fill_null(-1).alias("delta_cache_hit"),
+        pl.col("lookup_total").diff().fill_null(-1).alias("delta_lookups"),
+        pl.col("masks_hit").diff().fill_null(-1).alias("delta_mask_hits"),
+    ]).select(["packets_before", "tcpdump_time"] + PCAP_STATS_FIELDS + ["delta_cache_hit", "lookup_total", "delta_lookups", "delta_mask_hits"])
 
+@cached
 def parse_udp_rr(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
     """
     return values:
@@ -153,6 +588,7 @@ def parse_udp_rr(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
     return latencies_only, dropped_only
 
 
+@cached
 def parse_icmp_rtt(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
     """
     return values:
@@ -160,7 +596,7 @@ def parse_icmp_rtt(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
         2. packets with timeouts
     """
 
-    df = pl.read_csv(filename, dtypes={"latency_us": pl.UInt64})
+    df = pl.read_csv(filename, dtypes={"ts": pl.Int64, "latency_us": pl.UInt64})
 
     latencies_only = df.lazy().filter(pl.col("latency_us") != 0xFFFF_FFFF_FFFF_FFFF).with_columns((pl.col("latency_us") * 1_000).alias("latency_ns")).collect()
     dropped_only = df.filter(pl.col("latency_us") == 0xFFFF_FFFF_FFFF_FFFF)
@@ -169,27 +605,165 @@ def parse_icmp_rtt(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame]:
 
 
 
+# dtypes of the columns of the collector CSVs, older results don't have all of them
+DPCTL_DTYPES = {
+    "ns_monotonic": pl.Int64, "lookup_hit": pl.Int64, "lookup_missed": pl.Int64, "lookup_lost": pl.Int64, "flows": pl.Int64,
+    "masks_hit": pl.Int64, "masks_total": pl.Int64, "masks_hit_per_pkt": pl.Float64, "cache_hit": pl.Int64,
+    "cache_hit_rate": pl.Float64, "cache_masks_size": pl.Int64,
+}
+LOADAVG_DTYPES = {
+    "ts": pl.Int64, "loadavg1": pl.Float64, "loadavg5": pl.Float64, "loadavg15": pl.Float64, "proc_running": pl.Int64, "proc_all": pl.Int64,
+}
+VSWITCHD_DTYPES = {
+    "ts": pl.Int64, "vswitchd_utime_sec": pl.Float64, "vswitchd_stime_sec": pl.Float64, "vswitchd_rss_bytes": pl.Int64,
+    "vswitchd_threads": pl.Int64, "vswitchd_vsize_bytes": pl.Int64,
+}
+
+def with_dtypes(df: pl.DataFrame, dtypes: dict) -> pl.DataFrame:
+    """
+    `df` with those of its columns that are in `dtypes` cast to them, so that chunks of a file parsed separately
+    (by `FollowedFile`) don't depend on what the chunk contains
+    """
+    return df.with_columns([pl.col(c).cast(t) for c, t in dtypes.items() if c in df.columns])
+
+@cached
 def parse_dpctl_dump(filename: str) -> pl.DataFrame:
-    return pl.read_csv(filename).rename({'ns_monotonic': 'ts'})
+    return with_dtypes(pl.read_csv(filename), DPCTL_DTYPES).rename({'ns_monotonic': 'ts'})
 
+@cached
 def parse_loadavg(filename: str) -> pl.DataFrame:
-    return pl.read_csv(filename)
+    return with_dtypes(pl.read_csv(filename), LOADAVG_DTYPES)
 
+@cached
 def parse_vswitchd(filename: str) -> pl.DataFrame:
-    return pl.read_csv(filename)
+    return with_dtypes(pl.read_csv(filename), VSWITCHD_DTYPES)
 
-def parse_usdt(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+@cached
+def parse_usdt(filename: str) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    return values:
+        1. new flow limits, one per revalidator loop
+        2. revalidator barriers and waits
+        3. kernel lock hold times (`ovs_*` probes)
+        4. revalidator intervals with `start`, `end` (= `ts`), `tid` and `phase`, which is `revalidate` for the whole
+           loop and the probe name (e.g. `barrier_first_exit`) for the barriers and waits. `start` is null for loops without a
+           recorded start, barriers and waits without one are left out. the loops come first, then the barriers and
+           waits, each in the order of the file
+    """
     df = pl.read_csv(filename, separator=";", dtypes={"ts": pl.Int64, "flow_limit": pl.Int64, "duration_ns": pl.Int64, "flows": pl.Int64, "tid": pl.Int64})
+    with_duration_sec = (pl.col("duration_ns").cast(pl.Float64) / 1_000_000_000).alias("duration_sec")
+    # exits without a recorded entry have the duration equal to the timestamp
+    has_start = pl.col("duration_ns") != pl.col("ts")
+
     flow_limits = df.lazy().filter(pl.col("probe") == "new_flow_limit").drop("probe").collect()
-    barriers = df.lazy().filter(pl.col("probe") != "new_flow_limit").filter(pl.col("probe").str.starts_with("ovs_").is_not()).filter(pl.col("duration_ns") != pl.col("ts")).drop("flow_limit").drop("flows").with_columns((pl.col("duration_ns").cast(pl.Float64) / 1_000_000_000).alias("duration_sec")).collect()
-    kernel = df.lazy().filter(pl.col("probe").str.starts_with("ovs_")).drop("flow_limit").drop("flows").with_columns((pl.col("duration_ns").cast(pl.Float64) / 1_000_000_000).alias("duration_sec")).collect()
-    return flow_limits, barriers, kernel
+    barriers = df.lazy().filter(pl.col("probe") != "new_flow_limit").filter(pl.col("probe").str.starts_with("ovs_").is_not()).filter(has_start).drop("flow_limit").drop("flows").with_columns(with_duration_sec).collect()
+    kernel = df.lazy().filter(pl.col("probe").str.starts_with("ovs_")).drop("flow_limit").drop("flows").with_columns(with_duration_sec).collect()
+
+    # built from the frames above instead of another pass over the file. the phases are made categorical before the
+    # concat, which needs them under one string cache, rather than copying the strings first
+    start = pl.when(has_start).then(pl.col("ts") - pl.col("duration_ns")).otherwise(None).alias("start")
+    with pl.StringCache():
+        loops = flow_limits.lazy().select([pl.col("ts"), start, pl.col("ts").alias("end"), pl.col("tid"), pl.lit("revalidate").cast(pl.Categorical).alias("phase")])
+        waits = barriers.lazy().select([pl.col("ts"), start, pl.col("ts").alias("end"), pl.col("tid"), pl.col("probe").cast(pl.Categorical).alias("phase")])
+        intervals = pl.concat([loops, waits]).collect()
+
+    return flow_limits, barriers, kernel, intervals
+
+class Experiment:
+    """
+    results directory of one experiment with its files as LazyFrames, nothing is read before `collect()`
+
+    selected columns and time ranges are pushed down into the CSV scans. `ts` comes out in seconds since
+    the start of the experiment like after `normalize_ts`, `between` takes a range in these seconds:
+
+        exp = Experiment(d)
+        stressed = exp.scan("udp_rr", ["ts", "latency_ns"], between=STRESSED_INTERVAL).collect()
+    """
+
+    # source -> (file name pattern, scan_csv arguments)
+    SOURCES = {
+        "trace": ("kernel_flow_table_trace_*", {}),
+        "vswitchd": ("vswitchd*.csv", {}),
+        "udp_rr": ("udp_rr*csv", {"dtypes": {"latency_ns": pl.UInt64, "ts": pl.Int64}}),
+        "icmp_rtt": ("icmp_rtt*.csv", {"dtypes": {"latency_us": pl.UInt64}}),
+        "usdt": ("ovs-vswitchd-usdt*.csv", {"separator": ";", "dtypes": {"ts": pl.Int64, "flow_limit": pl.Int64, "duration_ns": pl.Int64, "flows": pl.Int64, "tid": pl.Int64}}),
+        "dpctl": ("log_ovs_dpctl_show*.csv", {}),
+        "loadavg": ("loadavg*.csv", {}),
+    }
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._timeline = None
+
+    def path(self, source: str) -> Optional[str]:
+        files = sorted(glob.glob(f"{self.directory}/{self.SOURCES[source][0]}"))
+        return files[0] if files else None
+
+    def log(self) -> Optional[str]:
+        """
+        the tracer log (`trace_log_*.jsonl`), for the `parse_*` functions of its records
+        """
+        files = sorted(glob.glob(f"{self.directory}/trace_log*.jsonl"))
+        return files[0] if files else None
+
+    def raw(self, source: str) -> pl.LazyFrame:
+        """
+        the source as recorded, `ts` in nanoseconds
+        """
+        filename = self.path(source)
+        assert filename is not None, f"no {source} file in {self.directory}"
+        if source == "trace":
+            return scan_trace(filename)
+
+        df = pl.scan_csv(filename, **self.SOURCES[source][1])
+        if source == "dpctl":
+            df = df.rename({"ns_monotonic": "ts"})
+        return df
+
+    @property
+    def timeline(self) -> "ExperimentTimeline":
+        """
+        zero at the first timestamp over all sources and the drop counts of the tracer log, like `normalize_ts` of
+        `load_packet_flood`. the zero of the `ts` returned by `scan`
+        """
+        if self._timeline is None:
+            starts = [self.raw(source).select("ts").head(1).collect().item() for source in self.SOURCES if self.path(source) is not None]
+            drops = parse_drops(self.log()) if self.log() is not None else None
+            if drops is not None and len(drops) > 0:
+                starts.append(drops.get_column("ts")[0])
+            self._timeline = ExperimentTimeline(min(starts))
+        return self._timeline
+
+    def scan(self, source: str, columns: Optional[List[str]] = None, between: Optional[Tuple[float, float]] = None) -> pl.LazyFrame:
+        df = self.raw(source)
+        if between is not None:
+            # filter on the raw timestamps, so that the predicate gets pushed down into the scan
+            df = df.filter(self.timeline.between(*between))
+        df = df.with_columns(self.timeline.seconds(pl.col("ts")))
+        if columns is not None:
+            df = df.select(columns)
+        return df
+
+    def upcalls(self, columns: Optional[List[str]] = None, between: Optional[Tuple[float, float]] = None) -> pl.LazyFrame:
+        """
+        upcall events of the trace, without the command names
+
+        each upcall of a sampled trace stands for `sample_rate` of them, given in the added `weight` column like in `trace_upcalls`
+        """
+        upcalls = self.scan("trace", between=between).filter(pl.col("event") == "UPCALL").select(columns or pl.all())
+        sample_rate = read_trace_metadata(self.path("trace")).get("sample_rate", 1)
+        if sample_rate > 1:
+            upcalls = upcalls.with_columns(pl.lit(sample_rate, dtype=pl.Int64).alias("weight"))
+        return upcalls
 
 def renumber(col: str, df: pl.DataFrame) -> pl.DataFrame:
     ids = df.lazy().select(col).unique().with_row_count(name=f"{col}_num")
     return df.lazy().join(ids, on=col, how="inner").collect()
 
-def remove_offset_and_scale(col: str, scale: float|int, *dfs: pl.DataFrame) -> list[pl.DataFrame]:
+def remove_offset_and_scale(col: str, scale: float|int, *dfs: pl.DataFrame, also: Tuple[str, ...] = ()) -> list[pl.DataFrame]:
+    """
+    the columns in `also` get the same offset and scale as `col`, in the frames which have them
+    """
     low = float('inf')
     for df in dfs:
         if len(df) > 0:
@@ -198,17 +772,417 @@ def remove_offset_and_scale(col: str, scale: float|int, *dfs: pl.DataFrame) -> l
     res = []
     for df in dfs:
         #df = df.assign(**{col: (df[col] - low) * scale})
-        df = df.with_columns(((pl.col(col) - low) * scale))
+        df = df.with_columns([(pl.col(c) - low) * scale for c in [col, *also] if c in df.columns])
         res.append(df)
     return res
 
 
+class ExperimentTimeline:
+    """
+    common zero of the timestamps of one experiment
+
+    frames keep their compact int64 ns `ts`, seconds since the zero are computed only where they are needed:
+
+        timeline = ExperimentTimeline.of(*frames)
+        ax.plot(timeline.seconds(loadavg["ts"]), loadavg["loadavg1"])
+        stressed = udp_rtt_latencies.filter(timeline.between(*STRESSED_INTERVAL))
+    """
+
+    def __init__(self, start_ns: int):
+        self.start_ns = int(start_ns)
+
+    @staticmethod
+    def of(*dfs: pl.DataFrame, col: str = "ts") -> "ExperimentTimeline":
+        """
+        zero at the earliest first timestamp of the frames, like `normalize_ts`
+        """
+        return ExperimentTimeline(min(df.get_column(col)[0] for df in dfs if len(df) > 0))
+
+    def seconds(self, ts):
+        """
+        seconds since the zero for ns timestamps, given as a series, numpy array, scalar or polars expression
+        """
+        return (ts - self.start_ns) / 1_000_000_000
+
+    def ns(self, seconds: float) -> int:
+        """
+        timestamp in ns of the time `seconds` after the zero
+        """
+        return self.start_ns + round(seconds * 1_000_000_000)
+
+    def between(self, start: float, end: float, col: str = "ts") -> pl.Expr:
+        """
+        filter on the ns timestamps for a range in seconds since the zero
+        """
+        return pl.col(col).is_between(self.ns(start), self.ns(end))
+
+    def normalized(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        copy of the frame with `ts` (and `start`, `end`) in seconds like after `normalize_ts`, meant for small frames
+        """
+        return df.with_columns([self.seconds(pl.col(c)) for c in ["ts", "start", "end"] if c in df.columns])
+
 def normalize_ts(*args: pl.DataFrame) -> list[pl.DataFrame]:
-    return remove_offset_and_scale('ts', 0.000_000_001, *args)
+    return remove_offset_and_scale('ts', 0.000_000_001, *args, also=("start", "end"))
+
+def load_concurrently(*jobs: Tuple[Callable, ...]) -> list:
+    """
+    run the `(parse, filename, *args)` jobs in a thread pool, results are returned in order
+
+    polars releases the GIL while reading, so this takes about as long as the largest file. prints how long each job took
+    """
+    def run(job):
+        parse, filename, *args = job
+        start = time.monotonic()
+        return parse(filename, *args), time.monotonic() - start
+
+    start = time.monotonic()
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = {pool.submit(run, job): i for i, job in enumerate(jobs)}
+        # printed here as the jobs finish, not from the workers
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i], duration = future.result()
+            parse, filename = jobs[i][:2]
+            print(f"  {parse.__name__}({os.path.basename(filename)}): {duration:.2f}s")
+    print(f"  loaded in {time.monotonic() - start:.2f}s")
+    return results
+
+def load_packet_flood(d: str, normalize: bool = True) -> list[pl.DataFrame]:
+    """
+    inputs of the packet_flood scripts from the results directory `d`, loaded concurrently and normalized by `normalize_ts`
+    unless `normalize` is False (to use an `ExperimentTimeline` instead)
+
+    in order: trace_table, trace_cmd, trace_upcalls, trace_upcalls_filtered, vswitchd, udp_rtt_latencies, udp_rtt_dropped,
+    icmp_lat, icmp_err, usdt_flow_limit, usdt_barriers, kernel_lock, usdt_intervals, dpctl_log, loadavg, tracer_drops
+    """
+    tracer_log = glob.glob(f"{d}/trace_log*.jsonl")[0]
+    trace, vswitchd, udp_rr, icmp_rtt, usdt, dpctl_log, loadavg, tracer_drops = load_concurrently(
+        (parse_trace, glob.glob(f"{d}/kernel_flow_table_trace_*")[0], tracer_log),
+        (parse_vswitchd, glob.glob(f"{d}/vswitchd*.csv")[0]),
+        (parse_udp_rr, glob.glob(f"{d}/udp_rr*csv")[0]),
+        (parse_icmp_rtt, glob.glob(f"{d}/icmp_rtt*.csv")[0]),
+        (parse_usdt, glob.glob(f"{d}/ovs-vswitchd-usdt*.csv")[0]),
+        (parse_dpctl_dump, glob.glob(f"{d}/log_ovs_dpctl_show*.csv")[0]),
+        (parse_loadavg, glob.glob(f"{d}/loadavg*.csv")[0]),
+        (parse_drops, tracer_log),
+    )
+    frames = [*trace, vswitchd, *udp_rr, *icmp_rtt, *usdt, dpctl_log, loadavg, tracer_drops]
+    return normalize_ts(*frames) if normalize else frames
+
+class TailReader:
+    """
+    the complete lines appended to a growing file since the last `read()`
+
+    CSV files get their header line (the first line that isn't a `# key=value` comment) put in front of
+    every chunk, so that each chunk can be parsed on its own. the comment lines before it are kept in `comments`
+    """
+
+    def __init__(self, filename: str, header: bool = True):
+        self.filename = filename
+        self.offset = 0
+        self.header = None if header else b""
+        self.comments = b""
+
+    def read(self) -> Optional[bytes]:
+        """
+        the new complete lines, None if there are none
+        """
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        # a line that is still being written is left for the next call
+        data = data[:data.rfind(b"\n") + 1]
+        self.offset += len(data)
+
+        if self.header is None:
+            while data.startswith(b"#"):
+                end = data.index(b"\n") + 1
+                self.comments += data[:end]
+                data = data[end:]
+            if not data:
+                return None
+            end = data.index(b"\n") + 1
+            self.header, data = data[:end], data[end:]
+        return self.header + data if data else None
+
+def append_frames(frames: Optional[pl.DataFrame], new: pl.DataFrame) -> pl.DataFrame:
+    # the chunks are parsed with fixed dtypes, so this only appends the chunks of `new` without copying.
+    # an empty frame may lack columns that depend on the content (event types in `parse_drops`)
+    if frames is None or len(frames) == 0:
+        return new
+    if len(new) == 0:
+        return frames
+    return pl.concat([frames, new], rechunk=False)
+
+class FollowedFile:
+    """
+    result of `parse(filename)` for a file that is still being written, `update()` parses only the lines appended
+    since the last call and appends their frames. `result` is None until the file has data, the file is the first one
+    matching `pattern` and doesn't need to exist yet
+
+    `parse` is one of the `parse_*` functions that can take the file content instead of its name. once `set_timeline()`
+    was called, `ts` (and `start`, `end`) are in seconds of the timeline, new chunks are converted as they are read.
+    categoricals of different chunks can only be appended under one string cache, so files are followed within a
+    `pl.StringCache()`
+    """
+
+    def __init__(self, parse: Callable, pattern: str, header: bool = True):
+        self.parse = parse
+        self.pattern = pattern
+        self.header = header
+        self.reader = None
+        self.result = None
+        self.timeline = None
+
+    def start(self, filename: str) -> bool:
+        """
+        called once the file exists, until it returns True
+        """
+        self.reader = TailReader(filename, self.header)
+        return True
+
+    def update(self) -> bool:
+        """
+        whether there were new lines
+        """
+        if self.reader is None:
+            files = sorted(glob.glob(self.pattern))
+            if not files or not self.start(files[0]):
+                return False
+
+        chunk = self.reader.read()
+        if chunk is None:
+            return False
+        self.append(self.parse(chunk))
+        return True
+
+    def has_data(self) -> bool:
+        """
+        whether any of the frames has rows
+        """
+        frames = self.result if isinstance(self.result, tuple) else [self.result]
+        return any(df is not None and len(df) > 0 for df in frames)
+
+    def append(self, result):
+        assert pl.using_string_cache(), "files are followed within a pl.StringCache()"
+        if self.timeline is not None:
+            result = tuple(map(self.timeline.normalized, result)) if isinstance(result, tuple) else self.timeline.normalized(result)
+        if isinstance(result, tuple):
+            self.result = tuple(append_frames(old, new) for old, new in zip(self.result or [None] * len(result), result))
+        else:
+            self.result = append_frames(self.result, result)
+
+    def set_timeline(self, timeline: "ExperimentTimeline"):
+        self.timeline = timeline
+        if isinstance(self.result, tuple):
+            self.result = tuple(map(timeline.normalized, self.result))
+        elif self.result is not None:
+            self.result = timeline.normalized(self.result)
+
+# dtypes of the columns of the event traces, the columns present depend on the tracer version
+TRACE_DTYPES = {"event": pl.Utf8, "cpu": pl.Int64, "pid": pl.Int64, "ts": pl.Int64, "flows": pl.Int64, "comm": pl.Utf8}
+
+class FollowedTrace(FollowedFile):
+    """
+    `parse_trace` of an uncompressed, not rotated CSV or JSONL trace that is still being written
+
+    the flow counts carry over between the chunks. upcalls get the command names from the COMMS records the tracer
+    logs while running, upcalls read before the name of their pid was logged get it at a later `update()`
+    """
+
+    def __init__(self, pattern: str, log_pattern: Optional[str] = None):
+        super().__init__(self.parse_chunk, pattern)
+        self.log = FollowedFile(parse_comms, log_pattern, header=False) if log_pattern is not None else None
+        self.comms = EMPTY_COMMS
+        # whether the trace has the command names itself, older traces do
+        self.has_comms = False
+        # flow counts after the last event so far, of the table and of the commands
+        self.flows = {"table": 0, "cmd": 0}
+        # from the `# sample_rate` line, known with the first chunk
+        self.sample_rate = None
+
+    def start(self, filename: str) -> bool:
+        assert not is_compressed(filename) and trace_parts(filename) == [filename], "only uncompressed traces without rotation can be followed"
+        # the format is told by the first line, which the tracer may not have written out yet
+        with open(filename, "rb") as f:
+            if not f.readline().endswith(b"\n"):
+                return False
+        fmt = trace_format(filename)
+        assert fmt != "bin", "binary traces can't be followed"
+        self.csv = fmt == "csv"
+        self.header = self.csv
+        return super().start(filename)
+
+    def update(self) -> bool:
+        new_comms = self.log is not None and self.log.update()
+        if new_comms:
+            self.comms = self.log.result.unique(["pid", "since"], keep="last", maintain_order=True)
+        updated = super().update()
+
+        if new_comms and self.result is not None and not self.has_comms:
+            table, cmd, upcalls, _ = self.result
+            missing = upcalls.filter(pl.col("comm").is_null()).get_column("pid")
+            if missing.is_in(self.comms.get_column("pid")).any():
+                # the upcalls can already be in seconds of the timeline
+                comms = self.comms if self.timeline is None else self.comms.with_columns(self.timeline.seconds(pl.col("since")))
+                upcalls, filtered = trace_upcalls(upcalls.drop("comm"), comms)
+                # same column order as the upcalls of later chunks
+                self.result = (table, cmd, upcalls.select(self.result[2].columns), filtered.select(self.result[3].columns))
+        return updated
+
+    def parse_chunk(self, chunk: bytes) -> Tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+        if self.sample_rate is None:
+            # the comment lines all come before the header of the first chunk
+            self.sample_rate = parse_metadata_lines(self.reader.comments.decode().splitlines()).get("sample_rate", 1)
+        trace = pl.read_csv(chunk, comment_char="#") if self.csv else pl.read_ndjson(chunk)
+        check_event_trace(self.reader.filename, trace.columns)
+        trace = with_dtypes(trace, TRACE_DTYPES)
+        self.has_comms = "comm" in trace.columns
+        steps = []
+        for name, deltas in (("table", TABLE_CHANGE), ("cmd", CMD_CHANGE)):
+            events = flow_events(trace, deltas, self.flows[name])
+            steps.append(flow_steps(events, self.flows[name]))
+            if len(events) > 0:
+                self.flows[name] = events.get_column("flows")[-1]
+        return (*steps, *trace_upcalls(trace, self.comms, self.sample_rate))
+
+def follow_packet_flood(d: str) -> Callable[[], Optional[list[pl.DataFrame]]]:
+    """
+    live version of `load_packet_flood(d)` for an experiment that is still running
+
+    the returned function reads what was appended to the files since its last call and returns all frames in the order
+    of `load_packet_flood`, or None while some file doesn't exist or has no data yet. the timestamps are normalized
+    like by `normalize_ts`, with the zero fixed at the first refresh that has data in all files. it is called within
+    a `pl.StringCache()`
+    """
+    tracer_log = f"{d}/trace_log*.jsonl"
+    followed = [
+        FollowedTrace(f"{d}/kernel_flow_table_trace_*", tracer_log),
+        FollowedFile(parse_vswitchd, f"{d}/vswitchd*.csv"),
+        FollowedFile(parse_udp_rr, f"{d}/udp_rr*csv"),
+        FollowedFile(parse_icmp_rtt, f"{d}/icmp_rtt*.csv"),
+        FollowedFile(parse_usdt, f"{d}/ovs-vswitchd-usdt*.csv"),
+        FollowedFile(parse_dpctl_dump, f"{d}/log_ovs_dpctl_show*.csv"),
+        FollowedFile(parse_loadavg, f"{d}/loadavg*.csv"),
+        FollowedFile(parse_drops, tracer_log, header=False),
+    ]
+    timeline = None
+
+    def refresh() -> Optional[list[pl.DataFrame]]:
+        nonlocal timeline
+        for f in followed:
+            f.update()
+        # the zero of the timeline is the earliest first timestamp of the files, all of them are needed for it
+        if any(not f.has_data() for f in followed):
+            return None
+        trace, vswitchd, udp_rr, icmp_rtt, usdt, dpctl_log, loadavg, tracer_drops = [f.result for f in followed]
+        frames = [*trace, vswitchd, *udp_rr, *icmp_rtt, *usdt, dpctl_log, loadavg, tracer_drops]
+        if timeline is None:
+            timeline = ExperimentTimeline.of(*frames)
+            frames = [timeline.normalized(df) for df in frames]
+            for f in followed:
+                f.set_timeline(timeline)
+        return frames
+
+    return refresh
 
 def window_frequency(df: pl.DataFrame, period: float) -> pl.DataFrame:
     mult = 10**len(str(period))
+    # sampled traces have a weight column with the sampling factor
+    count = pl.col("weight").sum() if "weight" in df.columns else pl.col('ts').count()
     return df.lazy().with_columns((pl.col("ts") * mult).cast(pl.Int64)).set_sorted("ts").groupby_rolling("ts", period=f"{int(period*mult)}i").agg([
         pl.col('ts').median().alias("mts") / mult,
-        (pl.col('ts').count() / (period)).alias("freq")
-    ]).collect()
\ No newline at end of file
+        (count / (period)).alias("freq")
+    ]).collect()
+
+def window_name(window: float) -> str:
+    return f"{window * 1000:g}ms" if window < 1 else f"{window:g}s"
+
+def window_rates(df: pl.DataFrame, windows: Tuple[float, ...] = (0.01, 0.1, 1.0), points: int = 2000) -> pl.DataFrame:
+    """
+    event rates (Hz) in windows of the given lengths (seconds), centred on `points` evenly spaced times
+
+    works on the `ts` column in ns, or in seconds after `normalize_ts`, and returns `ts` in the same unit. window
+    counts are exact, computed with binary searches on integer ns, and sampled traces are weighted by `weight`.
+    `max_rate_<window>` is the highest rate of any window centred within the interval around the point, so peaks
+    don't get lost between the points. the output has `points` rows no matter how many events there are, except for
+    events all at the same time, which give a single row
+
+    columns: ts, then rate_<window> and max_rate_<window> for each window, e.g. `rate_100ms`
+    """
+    seconds = df["ts"].dtype in (pl.Float32, pl.Float64)
+    ts = df["ts"].to_numpy()
+    ns = np.rint(ts * 1_000_000_000).astype(np.int64) if seconds else ts.astype(np.int64)
+    order = np.argsort(ns, kind="stable")
+    ns = ns[order]
+    weights = df["weight"].to_numpy()[order] if "weight" in df.columns else np.ones(len(ns), dtype=np.int64)
+    # total weight of the first i events at index i
+    cumulative = np.concatenate([[0], np.cumsum(weights)])
+
+    if len(ns) == 0:
+        return pl.DataFrame(schema={"ts": df["ts"].dtype, **{f"{kind}_{window_name(w)}": pl.Float64 for w in windows for kind in ("rate", "max_rate")}})
+
+    if ns[0] == ns[-1]:
+        points = 1
+    # integer ns, raw timestamps are above 2^53 where float64 loses nanoseconds. only the offsets are computed as floats
+    grid = ns[0] + np.rint(np.linspace(0, ns[-1] - ns[0], points)).astype(np.int64)
+    # interval around each point, as starts, between the points and half a step before the first one
+    step = grid[1] - grid[0] if points > 1 else 0
+    starts = np.concatenate([[grid[0] - step // 2], (grid[:-1] + grid[1:]) // 2])
+
+    def count(ends, window_ns):
+        # weight of the events in (end - window, end]
+        return cumulative[np.searchsorted(ns, ends, "right")] - cumulative[np.searchsorted(ns, ends - window_ns, "right")]
+
+    columns = {"ts": grid / 1_000_000_000 if seconds else grid}
+    for window in windows:
+        window_ns = round(window * 1_000_000_000)
+        half = window_ns // 2
+        columns[f"rate_{window_name(window)}"] = count(grid + half, window_ns) / window
+
+        # the count of a window only grows when its end reaches an event, so the highest count within an interval
+        # is the one at its start or the one of a window ending at an event whose window centre is in the interval
+        at_events = count(ns, window_ns)
+        interval = np.clip(np.searchsorted(starts, ns - half, "right") - 1, 0, points - 1)
+        highest = count(starts + half, window_ns)
+        # events are sorted, so each interval is a contiguous run of them
+        first = np.searchsorted(interval, np.arange(points))
+        nonempty = first < np.append(first[1:], len(ns))
+        highest[nonempty] = np.maximum(highest[nonempty], np.maximum.reduceat(at_events, first[nonempty]))
+        columns[f"max_rate_{window_name(window)}"] = highest / window
+
+    return pl.DataFrame(columns)
+
+
+# files of a results directory and how the postprocessing scripts parse them, for prewarming the cache
+CACHED_SOURCES = [
+    ("kernel_flow_table_trace_*", lambda d, f: parse_trace(f, glob.glob(f"{d}/trace_log*.jsonl")[0])),
+    ("trace_log*.jsonl", lambda d, f: parse_drops(f)),
+    ("vswitchd*.csv", lambda d, f: parse_vswitchd(f)),
+    ("udp_rr*csv", lambda d, f: parse_udp_rr(f)),
+    ("icmp_rtt*.csv", lambda d, f: parse_icmp_rtt(f)),
+    ("ovs-vswitchd-usdt*.csv", lambda d, f: parse_usdt(f)),
+    ("log_ovs_dpctl_show*.csv", lambda d, f: parse_dpctl_dump(f)),
+    ("loadavg*.csv", lambda d, f: parse_loadavg(f)),
+]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="manage the Parquet cache of parsed result files")
+    parser.add_argument("action", choices=["prewarm", "invalidate"])
+    parser.add_argument("directories", nargs="+", metavar="DIR", help="results directories")
+    options = parser.parse_args()
+
+    for d in options.directories:
+        if options.action == "invalidate":
+            shutil.rmtree(os.path.join(d, CACHE_DIR), ignore_errors=True)
+            continue
+
+        for pattern, parse in CACHED_SOURCES:
+            files = glob.glob(f"{d}/{pattern}")
+            if files:
+                print(f"{d}: {os.path.basename(files[0])}")
+                parse(d, files[0])
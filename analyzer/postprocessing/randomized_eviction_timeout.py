@@ -3,7 +3,7 @@ from matplotlib import pyplot as plt
 import matplotlib.patches as mpatches
 import numpy as np
 import sys
-from window import rolling_window_left
+from window import rolling_quantiles
 
 if len(sys.argv) != 3:
     print("missing argument: [name of input csv] [name of the output file]")
@@ -43,12 +43,12 @@ def median_line(lat, width):
     q75 = []
     wmin = []
     wmax = []
-    for micros_left, values in rolling_window_left(dataframe["us_since_last_measurement"], dataframe[lat], width):
-        medians.append(np.median(values))
-        wmin.append(np.quantile(values, 0.05))
-        wmax.append(np.quantile(values, 0.95))
-        q25.append(np.quantile(values, 0.25))
-        q75.append(np.quantile(values, 0.75))
+    for micros_left, (low, lower, median, upper, high) in rolling_quantiles(dataframe["us_since_last_measurement"], dataframe[lat], width, (0.05, 0.25, 0.5, 0.75, 0.95)):
+        medians.append(median)
+        wmin.append(low)
+        wmax.append(high)
+        q25.append(lower)
+        q75.append(upper)
         times.append((micros_left + width/2) / 1000)  # centered
     return times, medians, q25, q75, wmin, wmax
 
@@ -0,0 +1,88 @@
+import sys
+import glob
+import polars as pl
+from parsing import Experiment, parse_tracer_summary
+
+
+if len(sys.argv) < 2:
+    print("missing argument: [results directories of the same workload, run with node-logger --tracer-attach off, kprobe and trampoline]...")
+    exit(1)
+
+
+# only look at this range of seconds of every run, e.g. while the flood is running
+BETWEEN = None
+
+
+def tracer_summary(d):
+    logs = glob.glob(f"{d}/trace_log*.jsonl")
+    return parse_tracer_summary(logs[0]) if logs else None
+
+
+pl.Config.set_tbl_rows(-1)
+
+#
+# Cost of the tracer as seen by the workload: RTTs and losses of the UDP request/response
+# probes with the tracer off and attached through kprobes or trampolines
+#
+rows = []
+summaries = {}
+for d in sys.argv[1:]:
+    summary = tracer_summary(d)
+    summaries[d] = summary
+    exp = Experiment(d)
+    if exp.path("udp_rr") is None:
+        print(f"{d}: no UDP RTTs, skipped")
+        continue
+
+    rtts = exp.scan("udp_rr", ["ts", "latency_ns"], between=BETWEEN).collect()
+    answered = rtts.filter(pl.col("latency_ns") != 0xFFFF_FFFF_FFFF_FFFF)
+    rows.append((
+        d,
+        summary["attach"] if summary is not None else "off",
+        len(rtts),
+        1 - len(answered) / len(rtts) if len(rtts) > 0 else None,
+        answered["latency_ns"].median(),
+        answered["latency_ns"].quantile(0.99),
+        answered["latency_ns"].mean(),
+    ))
+
+workload = pl.DataFrame(rows, schema=[("run", pl.Utf8), ("attach", pl.Utf8), ("probes", pl.Int64), ("loss", pl.Float64),
+                                      ("median_ns", pl.Float64), ("p99_ns", pl.Float64), ("mean_ns", pl.Float64)])
+print("UDP RTTs per run:")
+print(workload.sort(["attach", "run"]))
+
+per_mode = workload.groupby("attach").agg([
+    pl.count().alias("runs"),
+    pl.col("loss").mean(),
+    pl.col("median_ns").mean(),
+    pl.col("p99_ns").mean(),
+    pl.col("mean_ns").mean(),
+]).sort("attach")
+off = per_mode.filter(pl.col("attach") == "off")
+if len(off) > 0:
+    per_mode = per_mode.with_columns([
+        (pl.col(c) / off[c][0]).alias(f"{c}_vs_off") for c in ["median_ns", "p99_ns", "mean_ns"]
+    ])
+else:
+    print("no run with the tracer off, no baseline to compare against")
+print("UDP RTTs per attach mode, averaged over the runs:")
+print(per_mode)
+
+#
+# Time spent in the programs as accounted by the kernel (--prog-stats), without the cost
+# of the kprobe breakpoint or the trampoline around them
+#
+rows = []
+for d, summary in summaries.items():
+    if summary is None or not summary.get("prog_stats"):
+        continue
+    for prog, stats in summary["prog_stats"].items():
+        rows.append((d, summary["attach"], prog, stats["run_cnt"], stats["run_time_ns"]))
+
+if rows:
+    df = pl.DataFrame(rows, schema=[("run", pl.Utf8), ("attach", pl.Utf8), ("prog", pl.Utf8), ("run_cnt", pl.Int64), ("run_time_ns", pl.Int64)])
+    df = df.with_columns((pl.col("run_time_ns") / pl.col("run_cnt")).alias("ns_per_run"))
+    print("program run times (kernel.bpf_stats_enabled):")
+    print(df.sort(["prog", "attach"]))
+    print("mean cost of one program run per attach mode:")
+    print(df.groupby("attach").agg([pl.col("run_cnt").sum(), pl.col("run_time_ns").sum()]).with_columns((pl.col("run_time_ns") / pl.col("run_cnt")).alias("ns_per_run")))
@@ -1,5 +1,8 @@
+from bisect import bisect_left, insort
 from collections import deque
 
+import numpy as np
+
 
 def rolling_window_left(roll_by, roll_what, window_size):
     values = deque([None])
@@ -23,3 +26,96 @@ def rolling_window_left(roll_by, roll_what, window_size):
             break
 
         yield roll_by[start], values
+
+
+class SortedWindow:
+    """
+    multiset of numbers kept sorted in blocks of at most `2 * load` values, values are added and removed in
+    O(log n + load) and looked up by rank in O(n / load)
+    """
+
+    def __init__(self, load=512):
+        self.load = load
+        self.blocks = []
+        # largest value of each block
+        self.maxes = []
+        self.len = 0
+
+    def __len__(self):
+        return self.len
+
+    def add(self, value):
+        if not self.blocks:
+            self.blocks.append([value])
+            self.maxes.append(value)
+        else:
+            i = min(bisect_left(self.maxes, value), len(self.blocks) - 1)
+            block = self.blocks[i]
+            insort(block, value)
+            self.maxes[i] = block[-1]
+            if len(block) > 2 * self.load:
+                self.blocks[i:i+1] = [block[:self.load], block[self.load:]]
+                self.maxes[i:i+1] = [block[self.load - 1], block[-1]]
+        self.len += 1
+
+    def remove(self, value):
+        i = bisect_left(self.maxes, value)
+        block = self.blocks[i]
+        del block[bisect_left(block, value)]
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+        self.len -= 1
+
+    def quantiles(self, qs):
+        """
+        the `qs` quantiles (sorted, in [0, 1]) with the linear interpolation of `np.quantile`, in one pass over the blocks
+        """
+        ranks = []
+        for q in qs:
+            pos = q * (self.len - 1)
+            lo = int(pos)
+            ranks.append((lo, min(lo + 1, self.len - 1), pos - lo))
+
+        # the values at all ranks, ranks are ascending since the quantiles are
+        values = {}
+        wanted = sorted({r for lo, hi, _ in ranks for r in (lo, hi)})
+        k = 0
+        offset = 0
+        for block in self.blocks:
+            while k < len(wanted) and wanted[k] < offset + len(block):
+                values[wanted[k]] = block[wanted[k] - offset]
+                k += 1
+            if k == len(wanted):
+                break
+            offset += len(block)
+
+        return [values[lo] + (values[hi] - values[lo]) * frac for lo, hi, frac in ranks]
+
+
+def rolling_quantiles(roll_by, roll_what, window_size, qs):
+    """
+    the `qs` quantiles of the windows of `rolling_window_left`, yields the left end and the list of quantiles
+
+    the window is kept sorted and only updated by the values entering and leaving it, instead of sorting every window
+    """
+    roll_by = np.asarray(roll_by).tolist()
+    roll_what = np.asarray(roll_what).tolist()
+    values = SortedWindow()
+
+    end = -1  # inclusive
+    for start in range(len(roll_by)):
+        if start > 0:
+            values.remove(roll_what[start - 1])
+
+        while end+1 < len(roll_by) and roll_by[end+1] - roll_by[start] <= window_size:
+            end += 1
+            values.add(roll_what[end])
+
+        # we might have hit the end
+        if end == len(roll_by) - 1:
+            break
+
+        yield roll_by[start], values.quantiles(qs)
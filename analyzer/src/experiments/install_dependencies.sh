@@ -1,7 +1,7 @@
 #!/bin/bash
 
-DEPS_FEDORA="python3-psutil scapy tcpdump perf bpftrace bcc"
-DEPS_ARCH="python-psutil scapy tcpdump perf bpftrace"
+DEPS_FEDORA="python3-psutil scapy tcpdump perf bpftrace bcc bpftool"
+DEPS_ARCH="python-psutil scapy tcpdump perf bpftrace bpf"
 
 if command -v pacman; then
     pacman -Sy --noconfirm $DEPS_ARCH
@@ -2,6 +2,7 @@
 
 import signal
 from bcc import BPF
+from bcc.libbcc import lib as libbcc
 import argparse
 import sys
 import time
@@ -9,13 +10,27 @@ import json
 import enum
 import subprocess
 import os
+import ctypes
+import queue
+import resource
+import threading
+import socket
+import struct
+import collections
+import gzip
+import io
+import http.server
+import socketserver
+import hashlib
+import base64
+import fcntl
+import stat
 from dataclasses import dataclass
 
+# keep the includes minimal, parsing kernel headers is most of the compilation time
 ebpf_source = """
 #include <linux/sched.h>
-#include <linux/skbuff.h>
 #include <uapi/linux/bpf.h>
-#include <net/genetlink.h>
 
 
 enum {
@@ -29,81 +44,399 @@ enum {
     _EVENT_MAX_EVENT
 };
 
+enum {
+    OCCUPANCY_TABLE = 0,
+    OCCUPANCY_CMD = 1,
+    _OCCUPANCY_MAX
+};
+
 struct event_t {
     u32 event;
     u32 cpu;
     u32 pid;
     u64 ts;
-    char comm[TASK_COMM_LEN];  
+    s64 flows;
+};
+
+struct comm_t {
+    char comm[TASK_COMM_LEN];
+    // timestamp of the first event of the thread under this name
+    u64 since;
 };
 
 BPF_RINGBUF_OUTPUT(events, <BUFFER_PAGE_CNT>);
+// current command name of every thread seen, logged when it changes instead of written into every event
+BPF_HASH(comms, u32, struct comm_t, 65536);
 BPF_TABLE("percpu_array", uint32_t, uint64_t, dropcnt, _EVENT_MAX_EVENT);
+// threads whose name could not be stored because comms was full
+BPF_TABLE("percpu_array", uint32_t, uint64_t, commdropcnt, 1);
+BPF_TABLE("percpu_array", uint32_t, uint64_t, ringfill, 1);
+BPF_ARRAY(occupancy, s64, _OCCUPANCY_MAX);
+
+#ifdef COUNT_EVENTS
+// events per type before sampling, for the metrics and the flight recorder triggers
+BPF_TABLE("percpu_array", uint32_t, uint64_t, eventcnt, _EVENT_MAX_EVENT);
+#endif
+
+#ifdef AGGREGATE_NS
+struct bucket_key_t {
+    u64 bucket;
+    u64 event;
+};
+
+BPF_PERCPU_HASH(buckets, struct bucket_key_t, u64, 16384);
+#endif
+
+#if defined(FILTER_ONLY_COMM) || defined(FILTER_EXCLUDE_COMM)
+struct comm_key_t {
+    char comm[TASK_COMM_LEN];
+};
+
+BPF_HASH(comm_filter, struct comm_key_t, u8, 64);
+#endif
+
+#ifdef FILTER_ONLY_PID
+BPF_HASH(pid_filter, u32, u8, 64);
+#endif
 
-static struct event_t *init_event(u32 type) {
+static inline bool filtered_out() {
+#ifdef FILTER_ONLY_PID
+    u32 pid = bpf_get_current_pid_tgid() >> 32;
+    if (!pid_filter.lookup(&pid))
+        return true;
+#endif
+
+#if defined(FILTER_ONLY_COMM) || defined(FILTER_EXCLUDE_COMM)
+    struct comm_key_t key = {};
+    bpf_get_current_comm(&key.comm, sizeof(key.comm));
+    bool listed = comm_filter.lookup(&key) != NULL;
+#ifdef FILTER_ONLY_COMM
+    if (!listed)
+        return true;
+#else
+    if (listed)
+        return true;
+#endif
+#endif
+
+    return false;
+}
+
+static inline void count_drop(u32 type) {
+    uint64_t *value = dropcnt.lookup(&type);
+    if (value)
+        __sync_fetch_and_add(value, 1);
+}
+
+static inline s64 update_occupancy(u32 type) {
+    // flow table size as seen by the table ops (TABLE_*) and by the netlink commands (CMD_*)
+    u32 idx = type <= EVENT_FLOW_CMD_DEL ? OCCUPANCY_CMD : OCCUPANCY_TABLE;
+    s64 *flows = occupancy.lookup(&idx);
+    if (!flows)
+        return 0;
+
+    switch (type) {
+    case EVENT_FLOW_CMD_NEW:
+    case EVENT_TABLE_INSERT:
+        __sync_fetch_and_add(flows, 1);
+        break;
+    case EVENT_FLOW_CMD_DEL:
+    case EVENT_TABLE_REMOVE:
+        __sync_fetch_and_add(flows, -1);
+        break;
+    case EVENT_TABLE_FLUSH:
+        *flows = 0;
+        break;
+    }
+
+    // the counter is exact, the returned value might already include updates from other CPUs
+    return *flows;
+}
+
+static inline void track_ring_fill() {
+    // high watermark of unconsumed data in the ring buffer
+    u32 zero = 0;
+    u64 avail = events.ringbuf_query(BPF_RB_AVAIL_DATA);
+    u64 *max = ringfill.lookup(&zero);
+    if (max && *max < avail)
+        *max = avail;
+}
+
+static struct event_t *init_event(u32 type, s64 flows) {
     struct event_t *event = events.ringbuf_reserve(sizeof(struct event_t));
+    track_ring_fill();
 
     if (!event) {
-        uint64_t *value = dropcnt.lookup(&type);
-        if (value)
-            __sync_fetch_and_add(value, 1);
-
+        count_drop(type);
         return NULL;
     }
 
+    u32 pid = bpf_get_current_pid_tgid();
     event->event = type;
     event->cpu =  bpf_get_smp_processor_id();
-    event->pid = bpf_get_current_pid_tgid();
+    event->pid = pid;
     event->ts = bpf_ktime_get_ns();
-    bpf_get_current_comm(&event->comm, sizeof(event->comm));
+    event->flows = flows;
+
+    // names change with exec and prctl(PR_SET_NAME) and pids get reused, so the stored name is checked every time
+    struct comm_t comm = {};
+    bpf_get_current_comm(&comm.comm, sizeof(comm.comm));
+    struct comm_t *known = comms.lookup(&pid);
+    if (!known || __builtin_memcmp(known->comm, comm.comm, sizeof(comm.comm)) != 0) {
+        comm.since = event->ts;
+        if (comms.update(&pid, &comm) < 0) {
+            u32 zero = 0;
+            uint64_t *value = commdropcnt.lookup(&zero);
+            if (value)
+                __sync_fetch_and_add(value, 1);
+        }
+    }
 
     return event;
 }
 
 static inline int handle(u32 type) {
-    struct event_t *event = init_event(type);
+    s64 flows = update_occupancy(type);
+    if (filtered_out())
+        return 0;
+
+#ifdef COUNT_EVENTS
+    u64 *seen = eventcnt.lookup(&type);
+    if (seen)
+        *seen += 1;
+#endif
+
+#ifdef AGGREGATE_NS
+    // only count the event in its time bucket, nothing goes through the ring buffer
+    struct bucket_key_t key = {
+        .bucket = bpf_ktime_get_ns() / AGGREGATE_NS,
+        .event = type,
+    };
+    u64 zero = 0;
+    u64 *count = buckets.lookup_or_try_init(&key, &zero);
+    if (!count) {
+        count_drop(type);
+        return 1;
+    }
+
+    // percpu map, no need for atomic ops
+    *count += 1;
+    return 0;
+#else
+#ifdef SAMPLE_RATE
+    // unbiased 1-in-N sampling, the occupancy counters above still see every event
+    if (bpf_get_prandom_u32() % SAMPLE_RATE)
+        return 0;
+#endif
+
+    struct event_t *event = init_event(type, flows);
     if (!event) {
         return 1;
     }
 
     events.ringbuf_submit(event, 0);
     return 0;
+#endif
 }
 """
-ebpf_source_table_ops = """
-int kprobe__ovs_flow_tbl_flush(struct pt_regs *ctx) {
-    return handle(EVENT_TABLE_FLUSH);
+# kernel functions producing events and the events they produce
+ebpf_hooks_table_ops = {
+    "ovs_flow_tbl_flush": "EVENT_TABLE_FLUSH",
+    "ovs_flow_tbl_insert": "EVENT_TABLE_INSERT",
+    "ovs_flow_tbl_remove": "EVENT_TABLE_REMOVE",
 }
 
-int kprobe__ovs_flow_tbl_insert(struct pt_regs *ctx) {
-    return handle(EVENT_TABLE_INSERT);
+ebpf_hooks_upcalls = {
+    "ovs_dp_upcall": "EVENT_UPCALL",
 }
 
-int kprobe__ovs_flow_tbl_remove(struct pt_regs *ctx) {
-    return handle(EVENT_TABLE_REMOVE);
+ebpf_hooks_cmd = {
+    "ovs_flow_cmd_set": "EVENT_FLOW_CMD_SET",
+    "ovs_flow_cmd_del": "EVENT_FLOW_CMD_DEL",
+    "ovs_flow_cmd_new": "EVENT_FLOW_CMD_NEW",
 }
 
-"""
-ebpf_source_upcalls = """
-int kprobe__ovs_dp_upcall(struct pt_regs *ctx) {
-    return handle(EVENT_UPCALL);
+# arguments of the hooked functions which are used by some of the hooks
+HOOK_ARGS = {
+    "ovs_dp_upcall": "void *dp, struct sk_buff *skb",
 }
-"""
 
-ebpf_source_cmd = """
-int kprobe__ovs_flow_cmd_set(struct pt_regs *ctx) {
-    return handle(EVENT_FLOW_CMD_SET);
+def ebpf_source_hooks(hooks, trampolines):
+    """
+    Generate one eBPF program per hooked function and entry/return, running all the
+    statements registered for it. BCC attaches the programs by their names, so every
+    function can have only one of each.
+
+    With trampolines, fentry/fexit programs are used instead of kprobes/kretprobes.
+    They don't go through the kprobe breakpoint machinery, which makes them cheaper.
+    """
+    source = ""
+    for (function, kind), statements in hooks.items():
+        args = HOOK_ARGS.get(function, "") if kind == "entry" else ""
+        if trampolines:
+            macro = "MODULE_KFUNC_PROBE" if kind == "entry" else "MODULE_KRETFUNC_PROBE"
+            header = f"{macro}(openvswitch, {function}{', ' if args else ''}{args})"
+        else:
+            prefix = "kprobe" if kind == "entry" else "kretprobe"
+            header = f"int {prefix}__{function}(struct pt_regs *ctx{', ' if args else ''}{args})"
+
+        source += header + " {\n"
+        for statement in statements:
+            source += f"    {statement}\n"
+        source += "    return 0;\n}\n\n"
+    return source
+
+
+def trampolines_supported():
+    # fentry/fexit on a module needs BTF of the module
+    return BPF.support_kfunc() and os.path.exists("/sys/kernel/btf/openvswitch")
+
+
+ebpf_source_latency = """
+struct start_key_t {
+    u64 pid_tgid;
+    u64 probe;
+};
+
+struct hist_key_t {
+    u64 probe;
+    u64 slot;
+};
+
+BPF_HASH(latency_start, struct start_key_t, u64, 10240);
+BPF_HISTOGRAM(latency, struct hist_key_t, 256);
+
+static inline int latency_entry(u64 probe) {
+    struct start_key_t key = {
+        .pid_tgid = bpf_get_current_pid_tgid(),
+        .probe = probe,
+    };
+    u64 ts = bpf_ktime_get_ns();
+    latency_start.update(&key, &ts);
+    return 0;
 }
 
-int kprobe__ovs_flow_cmd_del(struct pt_regs *ctx) {
-    return handle(EVENT_FLOW_CMD_DEL);
+static inline int latency_return(u64 probe) {
+    struct start_key_t key = {
+        .pid_tgid = bpf_get_current_pid_tgid(),
+        .probe = probe,
+    };
+    u64 *start = latency_start.lookup(&key);
+    if (!start)
+        return 0;
+
+    struct hist_key_t hist_key = {
+        .probe = probe,
+        .slot = bpf_log2l(bpf_ktime_get_ns() - *start),
+    };
+    latency_start.delete(&key);
+    latency.increment(hist_key);
+    return 0;
 }
+"""
+
+# kernel functions with measured duration, the index is the probe ID
+LATENCY_PROBES = ["ovs_dp_upcall", "ovs_flow_cmd_new", "ovs_flow_cmd_del", "ovs_flow_tbl_insert"]
+
+
+ebpf_source_flow_keys = """
+#include <linux/skbuff.h>
+#include <linux/if_ether.h>
+#include <linux/in.h>
+#include <linux/ip.h>
+#include <linux/udp.h>
+
+// the interesting parts of sw_flow_key, read from the packet headers
+struct flow_key_t {
+    u8 eth_src[ETH_ALEN];
+    u8 eth_dst[ETH_ALEN];
+    u16 eth_type;
+    u8 ip_proto;
+    u8 ip_tos;
+    u8 ip_ttl;
+    u8 pad[3];
+    u32 ip_src;
+    u32 ip_dst;
+    u16 tp_src;
+    u16 tp_dst;
+};
+
+struct flow_key_event_t {
+    u64 ts;
+    struct flow_key_t key;
+};
+
+BPF_RINGBUF_OUTPUT(flow_key_events, <BUFFER_PAGE_CNT>);
+BPF_TABLE("lru_hash", struct flow_key_t, u64, flow_keys_seen, <FLOW_KEYS_LRU_SIZE>);
 
-int kprobe__ovs_flow_cmd_new(struct pt_regs *ctx) {
-    return handle(EVENT_FLOW_CMD_NEW);
+static inline int capture_flow_key(struct sk_buff *skb) {
+    if (filtered_out())
+        return 0;
+
+    struct flow_key_t key;
+    __builtin_memset(&key, 0, sizeof(key));
+
+    // OVS has already parsed the packet when upcalling, the header offsets are set
+    unsigned char *head;
+    u16 mac_header, network_header, transport_header;
+    bpf_probe_read_kernel(&head, sizeof(head), &skb->head);
+    bpf_probe_read_kernel(&mac_header, sizeof(mac_header), &skb->mac_header);
+    bpf_probe_read_kernel(&network_header, sizeof(network_header), &skb->network_header);
+    bpf_probe_read_kernel(&transport_header, sizeof(transport_header), &skb->transport_header);
+
+    struct ethhdr eth;
+    bpf_probe_read_kernel(&eth, sizeof(eth), head + mac_header);
+    __builtin_memcpy(key.eth_src, eth.h_source, ETH_ALEN);
+    __builtin_memcpy(key.eth_dst, eth.h_dest, ETH_ALEN);
+    key.eth_type = ntohs(eth.h_proto);
+
+    if (key.eth_type == ETH_P_IP) {
+        struct iphdr ip;
+        bpf_probe_read_kernel(&ip, sizeof(ip), head + network_header);
+        key.ip_proto = ip.protocol;
+        key.ip_tos = ip.tos;
+        key.ip_ttl = ip.ttl;
+        key.ip_src = ip.saddr;
+        key.ip_dst = ip.daddr;
+
+        if (ip.protocol == IPPROTO_TCP || ip.protocol == IPPROTO_UDP || ip.protocol == IPPROTO_SCTP) {
+            // the ports are at the same place in all of them
+            struct udphdr tp;
+            bpf_probe_read_kernel(&tp, sizeof(tp), head + transport_header);
+            key.tp_src = ntohs(tp.source);
+            key.tp_dst = ntohs(tp.dest);
+        }
+    }
+
+    u64 *count = flow_keys_seen.lookup(&key);
+    if (count) {
+        __sync_fetch_and_add(count, 1);
+        return 0;
+    }
+
+    u64 one = 1;
+    if (flow_keys_seen.insert(&key, &one)) {
+        // somebody else was faster
+        count = flow_keys_seen.lookup(&key);
+        if (count)
+            __sync_fetch_and_add(count, 1);
+        return 0;
+    }
+
+    struct flow_key_event_t *event = flow_key_events.ringbuf_reserve(sizeof(struct flow_key_event_t));
+    if (!event) {
+        // forget the key, so that it gets reported next time
+        flow_keys_seen.delete(&key);
+        return 1;
+    }
+    event->ts = bpf_ktime_get_ns();
+    event->key = key;
+    flow_key_events.ringbuf_submit(event, 0);
+    return 0;
 }
 """
 
+
 class EventType(enum.Enum):
     CMD_SET = 0
     CMD_NEW = 1
@@ -120,14 +453,323 @@ class Event:
     cpu: int
     pid: int
     ts: int
-    comm: str
+    flows: int
 
     @staticmethod
     def write_csv_header(file):
-        print("event,cpu,pid,ts,comm", file=file)
+        print("event,cpu,pid,ts,flows", file=file)
     
     def write_csv_line(self, file):
-        print(f"{self.event},{self.cpu},{self.pid},{self.ts},{self.comm}", file=file)
+        print(f"{self.event},{self.cpu},{self.pid},{self.ts},{self.flows}", file=file)
+
+@dataclass
+class Bucket:
+    event: EventType
+    ts: int
+    duration_ns: int
+    count: int
+
+    @staticmethod
+    def write_csv_header(file):
+        print("event,ts,duration_ns,count", file=file)
+
+    def write_csv_line(self, file):
+        print(f"{self.event},{self.ts},{self.duration_ns},{self.count}", file=file)
+
+class RawEvent(ctypes.Structure):
+    """
+    Mirror of the eBPF `struct event_t`, has to be kept in sync
+    """
+    _fields_ = [
+        ("event", ctypes.c_uint32),
+        ("cpu", ctypes.c_uint32),
+        ("pid", ctypes.c_uint32),
+        ("ts", ctypes.c_uint64),
+        ("flows", ctypes.c_int64),
+    ]
+
+
+class EventBatch:
+    """
+    Preallocated buffer the reader thread copies raw event_t records into, straight
+    from the ring buffer. Batches are handed to the writer thread and recycled, so
+    no Python objects are created per event.
+    """
+
+    def __init__(self, records=4096):
+        self.buffer = bytearray(ctypes.sizeof(RawEvent) * records)
+        self.address = ctypes.addressof((ctypes.c_char * len(self.buffer)).from_buffer(self.buffer))
+        self.size = 0
+
+    def fits(self, size):
+        return self.size + size <= len(self.buffer)
+
+    def add(self, data, size):
+        ctypes.memmove(self.address + self.size, data, size)
+        self.size += size
+
+    def records(self):
+        return memoryview(self.buffer)[:self.size]
+
+
+class BinaryEventWriter:
+    """
+    Writes out raw event_t records as they come in EventBatch buffers.
+
+    The file starts with a single line of JSON describing the record layout
+    (numpy-compatible field types with their offsets), raw records follow.
+    """
+
+    TYPES = {
+        ctypes.c_uint32: "<u4",
+        ctypes.c_uint64: "<u8",
+        ctypes.c_int64: "<i8",
+    }
+
+    def __init__(self, file, sample_rate=1):
+        self.file = file
+        self.record_size = ctypes.sizeof(RawEvent)
+
+        fields = []
+        for name, typ in RawEvent._fields_:
+            typestr = f"S{ctypes.sizeof(typ)}" if issubclass(typ, ctypes.Array) else self.TYPES[typ]
+            fields.append((name, getattr(RawEvent, name).offset, typestr))
+        header = {
+            "record_size": self.record_size,
+            "fields": fields,
+            "events": [e.name for e in EventType],
+            "sample_rate": sample_rate,
+        }
+        self.file.write(json.dumps(header).encode() + b"\n")
+
+    def write_records(self, data):
+        """
+        Write out concatenated records
+        """
+        assert len(data) % self.record_size == 0, "event_t and RawEvent are out of sync"
+
+        self.file.write(data)
+
+
+# file name suffixes of the compression algorithms of --compress
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+
+def open_compressed(path, compress):
+    """
+    Binary write handle compressing with the given algorithm, zstd and lz4 need their python packages
+    """
+    if compress == "gzip":
+        return gzip.open(path, "wb", compresslevel=1)
+    elif compress == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=1).stream_writer(open(path, "wb"))
+    elif compress == "lz4":
+        import lz4.frame
+        return lz4.frame.open(path, "wb")
+    return open(path, "wb")
+
+
+class RotatingOutput(io.RawIOBase):
+    """
+    Events file split into parts FILE.000, FILE.001, ... (plus the compression suffix).
+
+    rotate() closes the current part and the next write opens a new one. The writer
+    calls it between batches, so parts hold whole records. Everything written before
+    end_header() is repeated at the start of every part, so each part can be read alone.
+    FILE.manifest.json lists the parts in order. It is rewritten whenever a part is
+    opened, so the parts can be read even if the tracer did not exit cleanly. The
+    readers in parsing.py then drop the incomplete record or line at the end of the
+    last part, and accept a compressed part without its end-of-stream marker.
+    """
+
+    def __init__(self, path, format, compress=None, rotate_bytes=None, rotate_sec=None):
+        self.path = path
+        self.format = format
+        self.compress = compress
+        self.rotate_bytes = rotate_bytes
+        self.rotate_sec = rotate_sec
+        self.header = bytearray()
+        self.in_header = True
+        self.parts = []
+        self.part = None
+        self.part_bytes = 0
+        self.part_opened = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.in_header:
+            self.header += data
+            return len(data)
+
+        if self.part is None:
+            self.open_part()
+        self.part.write(data)
+        self.part_bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        if self.part is not None:
+            self.part.flush()
+
+    def end_header(self):
+        self.in_header = False
+
+    def rotation_due(self):
+        if self.part is None:
+            return False
+        return (self.rotate_bytes is not None and self.part_bytes >= self.rotate_bytes) or \
+               (self.rotate_sec is not None and time.monotonic() - self.part_opened >= self.rotate_sec)
+
+    def rotate(self):
+        self.close_part()
+
+    def open_part(self):
+        name = f"{self.path}.{len(self.parts):03d}{COMPRESSION_SUFFIXES[self.compress]}"
+        self.part = open_compressed(name, self.compress)
+        self.part.write(self.header)
+        self.part_bytes = 0
+        self.part_opened = time.monotonic()
+        self.parts.append({"file": os.path.basename(name), "opened_ns": time.monotonic_ns()})
+        self.write_manifest(complete=False)
+
+    def close_part(self):
+        if self.part is None:
+            return
+        self.part.close()
+        self.part = None
+        self.parts[-1]["bytes"] = self.part_bytes
+
+    def write_manifest(self, complete):
+        with open(self.path + ".manifest.json", "w") as f:
+            json.dump({
+                "format": self.format,
+                "compression": self.compress,
+                "complete": complete,
+                "parts": self.parts,
+            }, f)
+
+    def close(self):
+        if not self.closed:
+            # a trace without events still gets a part with the header
+            if not self.parts:
+                self.open_part()
+            self.close_part()
+            self.write_manifest(complete=True)
+        super().close()
+
+
+class FlightRecorder:
+    """
+    Keeps the raw records of the last window_ns (and at most max_bytes of them)
+    in memory instead of writing them out.
+
+    When triggered, the kept window goes to the BinaryEventWriter and records keep
+    being written through for another window_ns, retriggering extends that. The file
+    ends up with full detail around every incident and nothing in between. A record
+    is written at most once, so the file stays ordered.
+    """
+
+    def __init__(self, writer: BinaryEventWriter, window_ns, max_bytes):
+        self.writer = writer
+        self.window_ns = window_ns
+        self.max_bytes = max_bytes
+        self.chunks = collections.deque()  # (arrival ns, concatenated records of one batch)
+        self.size = 0
+        self.write_until = 0
+        self.dumps = 0
+        self.lock = threading.Lock()
+
+    def add(self, records):
+        now = time.monotonic_ns()
+        with self.lock:
+            if now < self.write_until:
+                self.writer.write_records(records)
+                return
+
+            # the batch buffer gets reused
+            chunk = bytes(records)
+            self.chunks.append((now, chunk))
+            self.size += len(chunk)
+            while self.chunks and (self.size > self.max_bytes or self.chunks[0][0] < now - self.window_ns):
+                _, dropped = self.chunks.popleft()
+                self.size -= len(dropped)
+
+    def trigger(self):
+        """
+        Write out the kept window, returns the number of records written
+        """
+        with self.lock:
+            records = self.size // self.writer.record_size
+            while self.chunks:
+                _, chunk = self.chunks.popleft()
+                self.writer.write_records(chunk)
+            self.size = 0
+            self.writer.file.flush()
+            self.write_until = time.monotonic_ns() + self.window_ns
+            self.dumps += 1
+        return records
+
+
+class RawFlowKey(ctypes.Structure):
+    """
+    Mirror of the eBPF `struct flow_key_event_t`
+    """
+    _fields_ = [
+        ("ts", ctypes.c_uint64),
+        ("eth_src", ctypes.c_uint8 * 6),
+        ("eth_dst", ctypes.c_uint8 * 6),
+        ("eth_type", ctypes.c_uint16),
+        ("ip_proto", ctypes.c_uint8),
+        ("ip_tos", ctypes.c_uint8),
+        ("ip_ttl", ctypes.c_uint8),
+        ("pad", ctypes.c_uint8 * 3),
+        ("ip_src", ctypes.c_uint32),
+        ("ip_dst", ctypes.c_uint32),
+        ("tp_src", ctypes.c_uint16),
+        ("tp_dst", ctypes.c_uint16),
+    ]
+
+
+@dataclass
+class FlowKey:
+    """
+    kind is "first" for the first upcall with the key, "total" for the final
+    number of upcalls of keys still remembered at the end of the run
+    """
+    kind: str
+    ts: int
+    count: int
+    eth_src: str
+    eth_dst: str
+    eth_type: int
+    ip_proto: int
+    ip_tos: int
+    ip_ttl: int
+    ip_src: str
+    ip_dst: str
+    tp_src: int
+    tp_dst: int
+
+    @staticmethod
+    def from_key(kind, ts, count, key):
+        return FlowKey(
+            kind, ts, count,
+            bytes(key.eth_src).hex(":"), bytes(key.eth_dst).hex(":"), key.eth_type,
+            key.ip_proto, key.ip_tos, key.ip_ttl,
+            # addresses are kept in network byte order
+            socket.inet_ntoa(struct.pack("=I", key.ip_src)), socket.inet_ntoa(struct.pack("=I", key.ip_dst)),
+            key.tp_src, key.tp_dst,
+        )
+
+    @staticmethod
+    def write_csv_header(file):
+        print("kind,ts,count,eth_src,eth_dst,eth_type,ip_proto,ip_tos,ip_ttl,ip_src,ip_dst,tp_src,tp_dst", file=file)
+
+    def write_csv_line(self, file):
+        print(f"{self.kind},{self.ts},{self.count},{self.eth_src},{self.eth_dst},{self.eth_type},{self.ip_proto},{self.ip_tos},{self.ip_ttl},{self.ip_src},{self.ip_dst},{self.tp_src},{self.tp_dst}", file=file)
+
 
 def event_to_dict(event):
     event_dict = {}
@@ -147,14 +789,927 @@ def event_to_dict(event):
 
 
 
-def receive_event_bcc(ctx, data, size):
+def receive_event(ctx, data, size):
     global events_received
     events_received += 1
 
-    event = b['events'].event(data)
+    if not batch.fits(size):
+        hand_over_batch()
+    batch.add(data, size)
+
+
+def hand_over_batch():
+    """
+    Queue the current batch for the writer thread and continue with an empty one.
+    If the writer is too far behind, the batch is dropped instead.
+    """
+    global batch
+    global max_backlog
+    global backlog_dropped
+
+    try:
+        batches.put_nowait(batch)
+    except queue.Full:
+        backlog_dropped += batch.size // ctypes.sizeof(RawEvent)
+        batch.size = 0
+        return
+
+    max_backlog = max(max_backlog, batches.qsize())
+    try:
+        batch = free_batches.get_nowait()
+    except queue.Empty:
+        batch = EventBatch()
+
+
+def receive_flow_key(ctx, data, size):
+    # rare enough to be written out right away
+    key = RawFlowKey.from_buffer_copy(ctypes.string_at(data, size))
+    FlowKey.from_key("first", key.ts, 1, key).write_csv_line(flow_keys_file)
+
+
+log_lock = threading.Lock()
+# pid -> since of the names written in COMMS records so far
+comms_written = {}
+
+
+def write_log(record):
+    """
+    Append a record to the log. The stats thread and the main thread both log,
+    each record goes out in one write under the lock so lines never interleave
+    """
+    with log_lock:
+        log_file.write(json.dumps(record) + "\n")
+
+
+def write_comms():
+    """
+    pid -> comm table for the events and since when each pid has had its name, parsing.parse_trace
+    joins it back by time. Only names not logged before are written, so that followed traces get
+    them while running. A name held for less than a stats interval can be missed
+    """
+    comms = {}
+    since = {}
+    for key, value in b.get_table("comms").items():
+        if comms_written.get(key.value) != value.since:
+            comms[key.value] = value.comm.decode(errors="ignore")
+            since[key.value] = value.since
+    if comms:
+        comms_written.update(since)
+        write_log({"event": "COMMS", "comms": comms, "since": since})
+
+
+def write_flow_key_totals():
+    now = time.monotonic_ns()
+    for key, count in b.get_table("flow_keys_seen").items():
+        FlowKey.from_key("total", now, count.value, key).write_csv_line(flow_keys_file)
+
+
+def read_events(stop: threading.Event):
+    """
+    Reader thread. Blocks in epoll until there is something in the ring buffer
+    and hands over whatever one poll returned as a single batch.
+
+    Stops the tracer when it fails, the error is re-raised by main.
+    """
+    global batch
+    global thread_error
+
+    batch = EventBatch()
+    try:
+        while not stop.is_set():
+            b.ring_buffer_poll(options.poll_timeout_ms)
+            if batch.size > 0:
+                hand_over_batch()
+
+        # whatever arrived since the last poll
+        b.ring_buffer_consume()
+        if batch.size > 0:
+            hand_over_batch()
+    except BaseException as e:
+        thread_error = e
+    finally:
+        stop.set()
+        batches.put(None)
+
+
+def write_events(stop: threading.Event):
+    """
+    Writer thread, converts the raw records and writes them out
+
+    Stops the tracer when it fails, the error is re-raised by main.
+    """
+    global thread_error
+
+    try:
+        while (received := batches.get()) is not None:
+            records = received.records()
+            if recorder is not None:
+                recorder.add(records)
+                with recorder.lock:
+                    rotate_export()
+            elif binary_writer is not None:
+                binary_writer.write_records(records)
+                rotate_export()
+            else:
+                assert export_file is not None
+                for offset in range(0, received.size, ctypes.sizeof(RawEvent)):
+                    Event(**event_to_dict(RawEvent.from_buffer_copy(received.buffer, offset))).write_csv_line(export_file)
+                rotate_export()
+            records.release()
+            received.size = 0
+            free_batches.put(received)
+    except BaseException as e:
+        thread_error = e
+        stop.set()
+        # the reader must not block on a full queue
+        while batches.get() is not None:
+            pass
+
+
+def rotate_export():
+    """
+    Start a new part of a rotated events file if it is due, call only between whole records
+    """
+    if export_output is None or not export_output.rotation_due():
+        return
+
+    export_file.flush()
+    export_output.rotate()
+
+
+def drain_buckets(final=False):
+    """
+    Write out all finished time buckets and remove them from the kernel map.
+    With final=True, the currently open bucket is written out as well.
+    """
+    global events_received
+
+    aggregate_ns = options.aggregate_ms * 1_000_000
+    current = time.monotonic_ns() // aggregate_ns  # bpf_ktime_get_ns() uses CLOCK_MONOTONIC
+
+    buckets = b.get_table("buckets")
+    finished = [(k, sum(v)) for k, v in buckets.items() if final or k.bucket < current]
+    for key, _ in finished:
+        del buckets[key]
 
     assert export_file is not None
-    Event(**event_to_dict(event)).write_csv_line(export_file)
+    for key, count in sorted(finished, key=lambda kv: (kv[0].bucket, kv[0].event)):
+        events_received += count
+        Bucket(EventType(key.event).name, key.bucket * aggregate_ns, aggregate_ns, count).write_csv_line(export_file)
+
+
+def export_histograms(last_export_ns):
+    """
+    Move the latency histograms from the kernel to the log file, one record per probe
+    """
+    now = time.monotonic_ns()
+
+    slots = {}
+    for key, count in b.get_table("latency").items_lookup_and_delete_batch():
+        slots.setdefault(key.probe, {})[key.slot] = count.value
+
+    for probe, counts in sorted(slots.items()):
+        write_log({
+            "event": "HISTOGRAM",
+            "ts": now,
+            "interval_ns": now - last_export_ns,
+            "probe": LATENCY_PROBES[probe],
+            "slots": [counts.get(slot, 0) for slot in range(max(counts) + 1)],
+        })
+
+    return now
+
+
+def export_drops(last_export_ns, last_drops):
+    """
+    Write the number of events dropped since the last call into the log, per event type
+    """
+    now = time.monotonic_ns()
+
+    dropcnt = b.get_table("dropcnt")
+    drops = {e.name: sum(dropcnt[e.value]) for e in EventType}
+    write_log({
+        "event": "DROPS",
+        "ts": now,
+        "interval_ns": now - last_export_ns,
+        "drops": {name: count - last_drops.get(name, 0) for name, count in drops.items()},
+    })
+
+    return now, drops
+
+
+def dump_flight_recorder(reason, value=None):
+    records = recorder.trigger()
+    write_log({
+        "event": "DUMP",
+        "ts": time.monotonic_ns(),
+        "reason": reason,
+        "value": value,
+        "records": records,
+    })
+
+
+def check_triggers(last_check_ns, last_upcalls, last_drops):
+    """
+    Dump the flight recorder if the upcall rate or the number of dropped events
+    since the last check crossed their thresholds
+    """
+    now = time.monotonic_ns()
+    upcalls = sum(b.get_table("eventcnt")[EventType.UPCALL.value])
+    drops = sum(sum(x) for x in b.get_table("dropcnt").values())
+
+    upcall_rate = (upcalls - last_upcalls) * 1e9 / (now - last_check_ns)
+    if options.trigger_upcall_rate is not None and upcall_rate >= options.trigger_upcall_rate:
+        dump_flight_recorder("upcall_rate", upcall_rate)
+    if options.trigger_drops is not None and drops - last_drops >= options.trigger_drops:
+        dump_flight_recorder("drops", drops - last_drops)
+
+    return now, upcalls, drops
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the latest snapshot of the metrics, whatever the path
+    """
+
+    def do_GET(self):
+        body = metrics_text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # no request logging into the node logger output
+
+
+class UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def start_metrics_server(address):
+    """
+    address is a path to a UNIX socket, PORT or HOST:PORT
+    """
+    if "/" in address:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = UnixMetricsServer(address, MetricsHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def update_metrics(last_update_ns, last_counts):
+    """
+    Replace the metrics snapshot with the current counters (Prometheus text format),
+    rates are over the time since the last update
+    """
+    global metrics_text
+
+    now = time.monotonic_ns()
+    eventcnt = b.get_table("eventcnt")
+    dropcnt = b.get_table("dropcnt")
+    occupancy = b.get_table("occupancy")
+    counts = {e.name: sum(eventcnt[e.value]) for e in EventType}
+    interval_sec = (now - last_update_ns) / 1e9
+
+    lines = [
+        "# HELP ovs_tracer_events_total Events seen by the tracer, before sampling",
+        "# TYPE ovs_tracer_events_total counter",
+        *[f'ovs_tracer_events_total{{event="{name}"}} {count}' for name, count in counts.items()],
+        "# HELP ovs_tracer_events_per_second Events per second over the last stats interval",
+        "# TYPE ovs_tracer_events_per_second gauge",
+        *[f'ovs_tracer_events_per_second{{event="{name}"}} {(count - last_counts.get(name, 0)) / interval_sec:.1f}' for name, count in counts.items()],
+        "# HELP ovs_tracer_events_dropped_total Events lost because the ring buffer was full",
+        "# TYPE ovs_tracer_events_dropped_total counter",
+        *[f'ovs_tracer_events_dropped_total{{event="{e.name}"}} {sum(dropcnt[e.value])}' for e in EventType],
+        "# HELP ovs_tracer_comms_dropped_total Threads without a command name because the comms map was full",
+        "# TYPE ovs_tracer_comms_dropped_total counter",
+        f"ovs_tracer_comms_dropped_total {sum(b.get_table('commdropcnt')[0])}",
+        "# HELP ovs_tracer_events_received_total Events read from the ring buffer",
+        "# TYPE ovs_tracer_events_received_total counter",
+        f"ovs_tracer_events_received_total {events_received}",
+        "# HELP ovs_tracer_flows Flow table occupancy as seen by the table ops and by the netlink commands",
+        "# TYPE ovs_tracer_flows gauge",
+        f'ovs_tracer_flows{{view="table"}} {occupancy[0].value}',
+        f'ovs_tracer_flows{{view="cmd"}} {occupancy[1].value}',
+    ]
+    metrics_text = "\n".join(lines) + "\n"
+
+    return now, counts
+
+
+def export_stats(stop: threading.Event):
+    """
+    Periodically writes time series from the kernel maps into the log
+    """
+    last_histograms_ns = last_drops_ns = last_check_ns = time.monotonic_ns()
+    last_drops = {}
+    last_upcalls = last_dropped = 0
+    if options.metrics is not None:
+        last_metrics_ns, last_counts = update_metrics(time.monotonic_ns(), {})
+    while not stop.wait(options.stats_interval_ms / 1000):
+        last_drops_ns, last_drops = export_drops(last_drops_ns, last_drops)
+        write_comms()
+        if options.metrics is not None:
+            last_metrics_ns, last_counts = update_metrics(last_metrics_ns, last_counts)
+        if recorder is not None:
+            last_check_ns, last_upcalls, last_dropped = check_triggers(last_check_ns, last_upcalls, last_dropped)
+            if dump_requested.is_set():
+                dump_requested.clear()
+                dump_flight_recorder("signal")
+        if options.latency_histograms:
+            last_histograms_ns = export_histograms(last_histograms_ns)
+
+    # last partial interval
+    export_drops(last_drops_ns, last_drops)
+    if options.latency_histograms:
+        export_histograms(last_histograms_ns)
+
+
+#
+# Compiled program cache
+#
+# BCC compiles the eBPF source with clang on every start, which takes seconds and
+# cannot load a precompiled object. After a compilation, the loaded programs and
+# the definitions of the maps they use are stored, keyed by the source and the
+# kernel. Later runs create the maps and load the programs through libbpf
+# without compiling, CachedBPF stands in for the BPF object then.
+#
+# The tracer runs as root and loads whatever the cache holds, so the cache
+# directory and its entries must belong to root and be writable only by it.
+# The cache is off unless --program-cache is given.
+#
+
+PROGRAM_CACHE_VERSION = 1
+
+BPF_LD_IMM64 = 0x18
+BPF_PSEUDO_MAP_FD = 1
+
+BPF_PROG_TYPE_KPROBE = 2
+BPF_PROG_TYPE_TRACING = 26
+BPF_TRACE_FENTRY = 24
+BPF_TRACE_FEXIT = 25
+BTF_KIND_FUNC = 12
+
+# map types whose values are per CPU
+PERCPU_MAP_TYPES = {5, 6, 10}
+
+# BCC attaches programs by the prefix of their names: prefix -> (program type, attach type, return probe)
+PROGRAM_KINDS = {
+    "kprobe__": (BPF_PROG_TYPE_KPROBE, 0, False),
+    "kretprobe__": (BPF_PROG_TYPE_KPROBE, 0, True),
+    "kfunc__": (BPF_PROG_TYPE_TRACING, BPF_TRACE_FENTRY, False),
+    "kretfunc__": (BPF_PROG_TYPE_TRACING, BPF_TRACE_FEXIT, True),
+}
+
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_SET_BPF = 0x40042408
+SYS_PERF_EVENT_OPEN = {"x86_64": 298, "aarch64": 241}
+
+
+class BpfMapInfo(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("id", ctypes.c_uint32),
+        ("key_size", ctypes.c_uint32),
+        ("value_size", ctypes.c_uint32),
+        ("max_entries", ctypes.c_uint32),
+        ("map_flags", ctypes.c_uint32),
+        ("name", ctypes.c_char * 16),
+    ]
+
+
+class BpfProgInfo(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("id", ctypes.c_uint32),
+    ]
+
+
+class BpfBtfInfo(ctypes.Structure):
+    _fields_ = [
+        ("btf", ctypes.c_uint64),
+        ("btf_size", ctypes.c_uint32),
+        ("id", ctypes.c_uint32),
+        ("name", ctypes.c_uint64),
+        ("name_len", ctypes.c_uint32),
+        ("kernel_btf", ctypes.c_uint32),
+    ]
+
+
+class BpfMapCreateOpts(ctypes.Structure):
+    _fields_ = [
+        ("sz", ctypes.c_size_t),
+        ("btf_fd", ctypes.c_uint32),
+        ("btf_key_type_id", ctypes.c_uint32),
+        ("btf_value_type_id", ctypes.c_uint32),
+        ("btf_vmlinux_value_type_id", ctypes.c_uint32),
+        ("inner_map_fd", ctypes.c_uint32),
+        ("map_flags", ctypes.c_uint32),
+    ]
+
+
+class BpfProgLoadOpts(ctypes.Structure):
+    _fields_ = [
+        ("sz", ctypes.c_size_t),
+        ("attempts", ctypes.c_int),
+        ("expected_attach_type", ctypes.c_uint32),
+        ("prog_btf_fd", ctypes.c_uint32),
+        ("prog_flags", ctypes.c_uint32),
+        ("prog_ifindex", ctypes.c_uint32),
+        ("kern_version", ctypes.c_uint32),
+        ("attach_btf_id", ctypes.c_uint32),
+        ("attach_prog_fd", ctypes.c_uint32),
+        ("attach_btf_obj_fd", ctypes.c_uint32),
+    ]
+
+
+class PerfEventAttr(ctypes.Structure):
+    # up to config2 (PERF_ATTR_SIZE_VER1), the rest stays zero
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+    ]
+
+
+RING_BUFFER_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t)
+
+
+def load_libbpf():
+    libbpf = ctypes.CDLL("libbpf.so.1", use_errno=True)
+    for name in ["btf__load_vmlinux_btf", "btf__load_module_btf", "ring_buffer__new"]:
+        getattr(libbpf, name).restype = ctypes.c_void_p
+    libbpf.btf__load_module_btf.argtypes = [ctypes.c_char_p, ctypes.c_void_p]
+    libbpf.btf__find_by_name_kind.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint32]
+    libbpf.btf__free.argtypes = [ctypes.c_void_p]
+    libbpf.ring_buffer__new.argtypes = [ctypes.c_int, RING_BUFFER_CALLBACK, ctypes.c_void_p, ctypes.c_void_p]
+    libbpf.ring_buffer__add.argtypes = [ctypes.c_void_p, ctypes.c_int, RING_BUFFER_CALLBACK, ctypes.c_void_p]
+    libbpf.ring_buffer__poll.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    libbpf.ring_buffer__consume.argtypes = [ctypes.c_void_p]
+    libbpf.ring_buffer__free.argtypes = [ctypes.c_void_p]
+    return libbpf
+
+
+def bpf_check(result, what):
+    # libbpf returns negative error codes
+    if result < 0:
+        raise OSError(-result, f"{what}: {os.strerror(-result)}")
+    return result
+
+
+def check_trusted(st, what):
+    """
+    Refuse cache files and directories that anyone but root could have written
+    """
+    if st.st_uid != 0:
+        raise PermissionError(f"{what} is owned by uid {st.st_uid}, not root")
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{what} is writable by group or others (mode {stat.S_IMODE(st.st_mode):o})")
+
+
+def open_cache_dir(cache_dir, create):
+    """
+    Check that the cache directory is a root-owned directory not writable by others,
+    creating it with mode 0700 if create is set and it doesn't exist yet
+    """
+    try:
+        st = os.lstat(cache_dir)
+    except FileNotFoundError:
+        if not create:
+            return False
+        os.mkdir(cache_dir, 0o700)
+        st = os.lstat(cache_dir)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"{cache_dir} is not a directory")
+    check_trusted(st, cache_dir)
+    return True
+
+
+def load_program_cache(path):
+    """
+    The cache entry at path, None if there is none. Symlinks and entries that aren't
+    root-owned regular files only root can write are refused
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except FileNotFoundError:
+        return None
+    with os.fdopen(fd) as f:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise PermissionError(f"{path} is not a regular file")
+        check_trusted(st, path)
+        return json.load(f)
+
+
+def program_cache_key(source):
+    uname = os.uname()
+    return hashlib.sha256(json.dumps([PROGRAM_CACHE_VERSION, source, uname.release, uname.version]).encode()).hexdigest()
+
+
+def program_kind(name):
+    """
+    (program type, attach type, return probe, kernel module, function) of a program by its BCC name
+    """
+    for prefix, (prog_type, attach_type, retprobe) in PROGRAM_KINDS.items():
+        if name.startswith(prefix):
+            target = name[len(prefix):]
+            module, sep, function = target.partition("__")
+            if prog_type == BPF_PROG_TYPE_KPROBE or not sep or not module:
+                # kprobes don't need the module, old BCC names kfuncs without it
+                module, function = "vmlinux", target
+            return prog_type, attach_type, retprobe, module, function
+    return None
+
+
+def map_fd_refs(insns):
+    """
+    Offsets of the map references in eBPF instructions, 64-bit immediate loads of map fds
+    """
+    offset = 0
+    while offset < len(insns):
+        if insns[offset] == BPF_LD_IMM64:
+            src = insns[offset + 1] >> 4
+            if src == BPF_PSEUDO_MAP_FD:
+                yield offset + 4
+            elif src != 0:
+                raise ValueError(f"unsupported 64-bit load source {src}")
+            offset += 16
+        else:
+            offset += 8
+
+
+# maps used from user space, also when no loaded program refers to them
+USER_TABLES = ["comms", "flow_keys_seen", "buckets", "latency", "dropcnt", "commdropcnt", "eventcnt", "occupancy", "ringfill",
+               "comm_filter", "pid_filter", "events", "flow_key_events"]
+
+
+def save_program_cache(b, path, libbpf):
+    """
+    Store the programs loaded by BCC, with map fds replaced by indexes into the stored map definitions
+    """
+    maps = []
+    indexes = {}
+
+    def add_map(fd, name=None):
+        if fd in indexes:
+            return
+        info = BpfMapInfo()
+        bpf_check(libbpf.bpf_obj_get_info_by_fd(fd, ctypes.byref(info), ctypes.byref(ctypes.c_uint32(ctypes.sizeof(info)))), "map info")
+        # the kernel keeps only 15 characters of the name
+        name = name or info.name.decode()
+        key_desc = libbcc.bpf_table_key_desc(b.module, name.encode())
+        leaf_desc = libbcc.bpf_table_leaf_desc(b.module, name.encode())
+        indexes[fd] = len(maps)
+        maps.append({
+            "name": name,
+            "type": info.type,
+            "key_size": info.key_size,
+            "value_size": info.value_size,
+            "max_entries": info.max_entries,
+            "flags": info.map_flags,
+            "key_desc": key_desc and key_desc.decode(),
+            "leaf_desc": leaf_desc and leaf_desc.decode(),
+        })
+
+    for name in USER_TABLES:
+        try:
+            add_map(b.get_table(name).map_fd, name)
+        except KeyError:
+            pass
+
+    programs = []
+    for i in range(libbcc.bpf_num_functions(b.module)):
+        name = libbcc.bpf_function_name(b.module, i).decode()
+        if program_kind(name) is None:
+            continue
+
+        insns = bytearray(b.dump_func(name))
+        for offset in map_fd_refs(insns):
+            fd = struct.unpack_from("<i", insns, offset)[0]
+            add_map(fd)
+            struct.pack_into("<i", insns, offset, indexes[fd])
+        programs.append({"name": name, "insns": base64.b64encode(insns).decode()})
+
+    entry = {
+        "license": libbcc.bpf_module_license(b.module).decode(),
+        "kern_version": libbcc.bpf_module_kern_version(b.module),
+        "maps": maps,
+        "programs": programs,
+    }
+    open_cache_dir(os.path.dirname(path), create=True)
+    # the entry appears complete or not at all
+    tmp = path + ".tmp"
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600), "w") as f:
+        json.dump(entry, f)
+    os.rename(tmp, path)
+
+
+class CachedTable:
+    """
+    Map created from the program cache, with the parts of the BCC table API used here
+    """
+
+    def __init__(self, bpf, spec, fd):
+        self.bpf = bpf
+        self.fd = fd
+        self.Key = BPF._decode_table_type(json.loads(spec["key_desc"])) if spec["key_desc"] else ctypes.c_uint8 * spec["key_size"]
+        self.Leaf = BPF._decode_table_type(json.loads(spec["leaf_desc"])) if spec["leaf_desc"] else ctypes.c_uint8 * spec["value_size"]
+        self.percpu = spec["type"] in PERCPU_MAP_TYPES
+        # per CPU values are 8 byte aligned
+        self.stride = (spec["value_size"] + 7) // 8 * 8
+
+    def key(self, key):
+        return self.Key(key) if isinstance(key, int) else key
+
+    def __getitem__(self, key):
+        key = self.key(key)
+        ncpus = self.bpf.ncpus
+        value = ctypes.create_string_buffer(self.stride * ncpus) if self.percpu else self.Leaf()
+        if self.bpf.libbpf.bpf_map_lookup_elem(self.fd, ctypes.byref(key), ctypes.byref(value)) < 0:
+            raise KeyError(key)
+        if not self.percpu:
+            return value
+        if self.stride == ctypes.sizeof(self.Leaf):
+            return (self.Leaf * ncpus).from_buffer_copy(value)
+        return [self.Leaf.from_buffer_copy(value, cpu * self.stride) for cpu in range(ncpus)]
+
+    def __setitem__(self, key, leaf):
+        key = self.key(key)
+        bpf_check(self.bpf.libbpf.bpf_map_update_elem(self.fd, ctypes.byref(key), ctypes.byref(leaf), 0), "map update")
+
+    def __delitem__(self, key):
+        key = self.key(key)
+        if self.bpf.libbpf.bpf_map_delete_elem(self.fd, ctypes.byref(key)) < 0:
+            raise KeyError(key)
+
+    def keys(self):
+        keys = []
+        previous = None
+        while True:
+            key = self.Key()
+            if self.bpf.libbpf.bpf_map_get_next_key(self.fd, previous, ctypes.byref(key)) < 0:
+                return keys
+            keys.append(key)
+            previous = ctypes.byref(key)
+
+    def items(self):
+        items = []
+        for key in self.keys():
+            try:
+                items.append((key, self[key]))
+            except KeyError:
+                pass  # deleted in the meantime
+        return items
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def items_lookup_and_delete_batch(self):
+        for key, value in self.items():
+            del self[key]
+            yield key, value
+
+    def open_ring_buffer(self, callback, ctx=None):
+        self.bpf.open_ring_buffer(self.fd, callback)
+
+
+class CachedBPF:
+    """
+    Stands in for the BCC BPF object when the programs come from the program cache:
+    creates the maps, loads and attaches the programs and offers the tables and
+    ring buffers like BCC does
+    """
+
+    def __init__(self, entry):
+        self.libbpf = load_libbpf()
+        self.ncpus = bpf_check(self.libbpf.libbpf_num_possible_cpus(), "number of CPUs")
+        self.fds = []
+        self.tables = {}
+        self.funcs = {}
+        self.ring_buffer = None
+        self.callbacks = []
+        try:
+            self.load(entry)
+        except BaseException:
+            self.close()
+            raise
+
+    def load(self, entry):
+        map_fds = []
+        for spec in entry["maps"]:
+            opts = BpfMapCreateOpts(sz=ctypes.sizeof(BpfMapCreateOpts), map_flags=spec["flags"])
+            fd = bpf_check(self.libbpf.bpf_map_create(spec["type"], spec["name"].encode(), spec["key_size"], spec["value_size"],
+                                                      spec["max_entries"], ctypes.byref(opts)), f"creating map {spec['name']}")
+            self.fds.append(fd)
+            map_fds.append(fd)
+            self.tables[spec["name"]] = CachedTable(self, spec, fd)
+
+        for program in entry["programs"]:
+            insns = bytearray(base64.b64decode(program["insns"]))
+            for offset in map_fd_refs(insns):
+                struct.pack_into("<i", insns, offset, map_fds[struct.unpack_from("<i", insns, offset)[0]])
+            self.load_program(program["name"], insns, entry["license"], entry["kern_version"])
+
+    def load_program(self, name, insns, license, kern_version):
+        prog_type, attach_type, retprobe, module, function = program_kind(name)
+        opts = BpfProgLoadOpts(sz=ctypes.sizeof(BpfProgLoadOpts), kern_version=kern_version)
+        if prog_type == BPF_PROG_TYPE_TRACING:
+            opts.expected_attach_type = attach_type
+            opts.attach_btf_id, opts.attach_btf_obj_fd = self.btf_target(module, function)
+
+        buffer = (ctypes.c_char * len(insns)).from_buffer(insns)
+        fd = bpf_check(self.libbpf.bpf_prog_load(prog_type, name[:15].encode(), license.encode(), buffer, len(insns) // 8,
+                                                 ctypes.byref(opts)), f"loading {name}")
+        self.fds.append(fd)
+        self.funcs[name] = BPF.Function(self, name, fd)
+
+        if prog_type == BPF_PROG_TYPE_TRACING:
+            self.fds.append(bpf_check(self.libbpf.bpf_raw_tracepoint_open(None, fd), f"attaching {name}"))
+        else:
+            self.fds.append(self.attach_kprobe(fd, function, retprobe))
+
+    def btf_target(self, module, function):
+        """
+        BTF type ID of the function and the fd of the BTF object containing it, 0 for vmlinux
+        """
+        vmlinux = self.libbpf.btf__load_vmlinux_btf()
+        if not vmlinux:
+            raise OSError(ctypes.get_errno(), "loading vmlinux BTF")
+        btf = vmlinux if module == "vmlinux" else self.libbpf.btf__load_module_btf(module.encode(), vmlinux)
+        try:
+            if not btf:
+                raise OSError(ctypes.get_errno(), f"loading BTF of {module}")
+            type_id = bpf_check(self.libbpf.btf__find_by_name_kind(btf, function.encode(), BTF_KIND_FUNC), f"BTF of {function}")
+        finally:
+            if btf and btf != vmlinux:
+                self.libbpf.btf__free(btf)
+            self.libbpf.btf__free(vmlinux)
+        return type_id, (0 if module == "vmlinux" else self.module_btf_fd(module))
+
+    def module_btf_fd(self, module):
+        btf_id = ctypes.c_uint32(0)
+        while self.libbpf.bpf_btf_get_next_id(btf_id, ctypes.byref(btf_id)) == 0:
+            fd = self.libbpf.bpf_btf_get_fd_by_id(btf_id)
+            if fd < 0:
+                continue
+            name = ctypes.create_string_buffer(64)
+            info = BpfBtfInfo(name=ctypes.addressof(name), name_len=len(name))
+            self.libbpf.bpf_obj_get_info_by_fd(fd, ctypes.byref(info), ctypes.byref(ctypes.c_uint32(ctypes.sizeof(info))))
+            if info.kernel_btf and name.value.decode() == module:
+                self.fds.append(fd)
+                return fd
+            os.close(fd)
+        raise OSError(f"no BTF object of {module}")
+
+    def attach_kprobe(self, prog_fd, function, retprobe):
+        """
+        perf kprobe event running the program, returns its fd
+        """
+        pmu = "/sys/bus/event_source/devices/kprobe"
+        with open(f"{pmu}/type") as f:
+            attr = PerfEventAttr(type=int(f.read()), size=ctypes.sizeof(PerfEventAttr))
+        if retprobe:
+            with open(f"{pmu}/format/retprobe") as f:
+                attr.config = 1 << int(f.read().split(":")[1])
+        name = ctypes.create_string_buffer(function.encode())
+        attr.config1 = ctypes.addressof(name)
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.syscall(SYS_PERF_EVENT_OPEN[os.uname().machine], ctypes.byref(attr), -1, 0, -1, 0)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), f"kprobe on {function}")
+        try:
+            fcntl.ioctl(fd, PERF_EVENT_IOC_SET_BPF, prog_fd)
+            fcntl.ioctl(fd, PERF_EVENT_IOC_ENABLE, 0)
+        except OSError:
+            os.close(fd)
+            raise
+        return fd
+
+    def get_table(self, name):
+        return self.tables[name]
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def open_ring_buffer(self, fd, callback):
+        # BCC callbacks don't have to return anything
+        fn = RING_BUFFER_CALLBACK(lambda ctx, data, size: callback(ctx, data, size) or 0)
+        self.callbacks.append(fn)
+        if self.ring_buffer is None:
+            self.ring_buffer = self.libbpf.ring_buffer__new(fd, fn, None, None)
+            if not self.ring_buffer:
+                raise OSError(ctypes.get_errno(), "opening ring buffer")
+        else:
+            bpf_check(self.libbpf.ring_buffer__add(self.ring_buffer, fd, fn, None), "adding ring buffer")
+
+    def ring_buffer_poll(self, timeout=-1):
+        return self.libbpf.ring_buffer__poll(self.ring_buffer, timeout)
+
+    def ring_buffer_consume(self):
+        return self.libbpf.ring_buffer__consume(self.ring_buffer)
+
+    def close(self):
+        """
+        Detach the programs and free the maps
+        """
+        if self.ring_buffer is not None:
+            self.libbpf.ring_buffer__free(self.ring_buffer)
+            self.ring_buffer = None
+        for fd in reversed(self.fds):
+            os.close(fd)
+        self.fds = []
+
+
+def compile_ebpf(source, debug, cache_dir):
+    """
+    Load the eBPF programs from the program cache in cache_dir, or compile them with
+    BCC and add them to the cache. Returns the BPF object (or its CachedBPF stand-in)
+    and whether it came from the cache
+    """
+    path = None
+    if cache_dir and not debug:
+        path = os.path.join(cache_dir, program_cache_key(source) + ".json")
+        try:
+            entry = load_program_cache(path) if open_cache_dir(cache_dir, create=False) else None
+            if entry is not None:
+                return CachedBPF(entry), True
+        except Exception as e:
+            print(f"- Cached programs not usable, compiling: {e}")
+
+    b = BPF(text=source, debug=debug)
+    if path is not None:
+        try:
+            save_program_cache(b, path, load_libbpf())
+        except Exception as e:
+            print(f"- Not caching the compiled programs: {e}")
+    return b, False
+
+
+BPF_STATS_SYSCTL = "/proc/sys/kernel/bpf_stats_enabled"
+
+def enable_bpf_stats():
+    """
+    Make the kernel account run time of eBPF programs, returns the previous setting
+    """
+    with open(BPF_STATS_SYSCTL) as f:
+        previous = f.read().strip()
+    with open(BPF_STATS_SYSCTL, "w") as f:
+        f.write("1")
+    return previous
+
+
+def program_ids():
+    """
+    Kernel program ID -> name of the eBPF programs of the tracer
+    """
+    libbpf = load_libbpf()
+    ids = {}
+    for name, func in b.funcs.items():
+        info = BpfProgInfo()
+        bpf_check(libbpf.bpf_obj_get_info_by_fd(func.fd, ctypes.byref(info), ctypes.byref(ctypes.c_uint32(ctypes.sizeof(info)))), "program info")
+        ids[info.id] = name
+    return ids
+
+
+def collect_prog_stats():
+    """
+    Run counts and total run times of the eBPF programs of the tracer, by program name.
+
+    The kernel truncates program names to 15 characters, the programs are found by
+    their IDs. It accounts only the time spent in the programs themselves, not the
+    cost of the kprobe breakpoint or the trampoline around them, compare the
+    workload itself with the tracer off and in the --attach modes for that
+    (postprocessing/tracer_overhead.py).
+    """
+    ids = program_ids()
+    progs = json.loads(subprocess.check_output(["bpftool", "prog", "show", "--json"]))
+    stats = {}
+    for prog in progs:
+        if prog["id"] not in ids:
+            continue
+        stats[ids[prog["id"]]] = {
+            "run_cnt": prog.get("run_cnt", 0),
+            "run_time_ns": prog.get("run_time_ns", 0),
+        }
+    return stats
 
 
 def next_power_of_two(val):
@@ -173,6 +1728,18 @@ def main():
     global options
     global events_received
     global export_file
+    global export_output
+    global binary_writer
+    global max_backlog
+    global backlog_dropped
+    global batches
+    global free_batches
+    global thread_error
+    global log_file
+    global flow_keys_file
+    global recorder
+    global dump_requested
+    global metrics_text
 
     #
     # Argument parsing
@@ -189,6 +1756,9 @@ def main():
     parser.add_argument("-w", "--write-events",
                         help="Write events to FILE",
                         type=str, required=True, metavar="FILE")
+    parser.add_argument("--format",
+                        help="Format of the events file, csv (default) or bin (raw event records, much cheaper to write)",
+                        choices=["csv", "bin"], default="csv")
     parser.add_argument("-l", "--log",
                         help="Write log to FILE",
                         type=str, required=True, metavar="FILE")
@@ -199,10 +1769,93 @@ def main():
     parser.add_argument("--no-upcalls", help="Do not trace upcalls",
                         action="store_false", default=True, dest="upcalls")  # inverted
     parser.add_argument("--signal-ready", help="Send SIGUSR1 to parent when tracing ready", action="store_true", default=False)
+    comm_filter = parser.add_mutually_exclusive_group()
+    comm_filter.add_argument("--only-comm",
+                        help="Trace only events from threads with this command name, can be repeated",
+                        action="append", default=None, metavar="COMM")
+    comm_filter.add_argument("--exclude-comm",
+                        help="Ignore events from threads with this command name, can be repeated",
+                        action="append", default=None, metavar="COMM")
+    parser.add_argument("--only-pid",
+                        help="Trace only events from this process (TGID), can be repeated",
+                        type=int, action="append", default=None, metavar="PID")
+    parser.add_argument("--max-backlog-batches",
+                        help="Number of batches of events which can wait for the writer, newer events are dropped when it is that far behind, default 256",
+                        type=int, default=256, metavar="NUMBER")
+    parser.add_argument("--poll-timeout-ms",
+                        help="How long can the reader block waiting for new events, limits shutdown delay, default 100",
+                        type=int, default=100, metavar="MS")
+    parser.add_argument("--sample-rate",
+                        help="Export only randomly chosen 1 in N events, default 1 (all events). No effect with --aggregate-ms",
+                        type=int, default=1, metavar="N")
+    parser.add_argument("--attach",
+                        help="How to attach to the kernel functions, fentry/fexit trampolines or kprobes, default auto (trampolines when supported)",
+                        choices=["auto", "trampoline", "kprobe"], default="auto")
+    parser.add_argument("--program-cache",
+                        help="Directory of the compiled program cache, e.g. /var/cache/log_flow_ops. Programs compiled once for the same "
+                             "source and kernel are loaded without compiling. The directory and its files must belong to root and not be "
+                             "writable by group or others, it is created with mode 0700. Experimental, default off (always compile)",
+                        type=str, default="", metavar="DIR")
+    parser.add_argument("--prog-stats",
+                        help="Enable kernel BPF statistics and record run count and run time of the programs in the log (needs bpftool)",
+                        action="store_true", default=False)
+    parser.add_argument("--latency-histograms",
+                        help="Measure durations of " + ", ".join(LATENCY_PROBES) + " and write log2 histograms into the log",
+                        action="store_true", default=False)
+    parser.add_argument("--flow-keys",
+                        help="Write every distinct upcalled flow key (MACs, IPs, ports, ToS, TTL) to FILE once, with repeat counts at the end",
+                        type=str, default=None, metavar="FILE")
+    parser.add_argument("--flow-keys-lru-size",
+                        help="Number of flow keys remembered as already seen, default 65536",
+                        type=int, default=65536, metavar="NUMBER")
+    parser.add_argument("--stats-interval-ms",
+                        help="How often to write out time series into the log, default 1000",
+                        type=int, default=1000, metavar="MS")
+    parser.add_argument("--aggregate-ms",
+                        help="Do not export individual events, count them in kernel in time buckets N milliseconds long",
+                        type=int, default=None, metavar="N")
+    parser.add_argument("--flight-recorder",
+                        help="Keep only the last SEC seconds of events in memory and write them out (with the next SEC seconds) when triggered by "
+                             "--trigger-upcall-rate, --trigger-drops or SIGUSR2. Needs --format bin",
+                        type=float, default=None, metavar="SEC")
+    parser.add_argument("--flight-recorder-mb",
+                        help="Upper bound on the memory used by the flight recorder, default 256",
+                        type=int, default=256, metavar="MB")
+    parser.add_argument("--trigger-upcall-rate",
+                        help="Dump the flight recorder when upcalls per second over a stats interval reach N",
+                        type=float, default=None, metavar="N")
+    parser.add_argument("--trigger-drops",
+                        help="Dump the flight recorder when N events are dropped within a stats interval",
+                        type=int, default=None, metavar="N")
+    parser.add_argument("--metrics",
+                        help="Serve event rates, drops and flow table occupancy in Prometheus text format on ADDR, "
+                             "a port, HOST:PORT or the path of a UNIX socket. Updated every stats interval",
+                        type=str, default=None, metavar="ADDR")
+    parser.add_argument("--compress",
+                        help="Compress the events file while writing it, into parts FILE.NNN.ext with FILE.manifest.json. "
+                             "zstd and lz4 need the zstandard and lz4 python packages",
+                        choices=["gzip", "zstd", "lz4"], default=None)
+    parser.add_argument("--rotate-mb",
+                        help="Split the events file into parts FILE.NNN of about MB megabytes of uncompressed data, with FILE.manifest.json",
+                        type=int, default=None, metavar="MB")
+    parser.add_argument("--rotate-sec",
+                        help="Start a new part of the events file every SEC seconds, with FILE.manifest.json",
+                        type=float, default=None, metavar="SEC")
 
 
 
     options = parser.parse_args()
+    if options.sample_rate < 1:
+        parser.error("--sample-rate must be at least 1")
+    if options.flight_recorder is not None and (options.format != "bin" or options.aggregate_ms is not None):
+        parser.error("--flight-recorder needs --format bin and no --aggregate-ms")
+    if options.flight_recorder is None and (options.trigger_upcall_rate is not None or options.trigger_drops is not None):
+        parser.error("--trigger-upcall-rate and --trigger-drops need --flight-recorder")
+    if options.compress in ("zstd", "lz4"):
+        try:
+            open_compressed(os.devnull, options.compress).close()
+        except ImportError as e:
+            parser.error(f"--compress {options.compress} needs the python package {e.name}")
 
 
     options.buffer_page_count = next_power_of_two(options.buffer_page_count)
@@ -210,14 +1863,58 @@ def main():
     #
     # Open write handle
     #
+    binary_writer = None
+    export_output = None
+    binary = options.format == "bin" and options.aggregate_ms is None
+    if options.compress is not None or options.rotate_mb is not None or options.rotate_sec is not None:
+        export_output = RotatingOutput(options.write_events, "bin" if binary else "csv", options.compress,
+                                       options.rotate_mb and options.rotate_mb * 1024 * 1024, options.rotate_sec)
+
+    def open_export(binary):
+        if export_output is None:
+            return open(options.write_events, "wb" if binary else "w")
+        return export_output if binary else io.TextIOWrapper(io.BufferedWriter(export_output))
+
     try:
-        export_file = open(options.write_events, "w")
-        Event.write_csv_header(export_file)
+        if options.aggregate_ms is not None:
+            export_file = open_export(False)
+            Bucket.write_csv_header(export_file)
+        elif binary:
+            export_file = open_export(True)
+            binary_writer = BinaryEventWriter(export_file, sample_rate=options.sample_rate)
+        else:
+            export_file = open_export(False)
+            if options.sample_rate > 1:
+                # parsing.parse_trace scales the counts back up
+                print(f"# sample_rate={options.sample_rate}", file=export_file)
+            Event.write_csv_header(export_file)
+
+        if export_output is not None:
+            # parts are opened lazily, this only moves the header into the rotating output
+            export_file.flush()
+            export_output.end_header()
     except (FileNotFoundError, IOError, PermissionError) as e:
         print("ERROR: Can't create export file \"{}\": {}".format(
             options.write_events, e.strerror))
         sys.exit(-1)
 
+    flow_keys_file = None
+    try:
+        if options.flow_keys is not None:
+            flow_keys_file = open(options.flow_keys, "w")
+            FlowKey.write_csv_header(flow_keys_file)
+    except (FileNotFoundError, IOError, PermissionError) as e:
+        print("ERROR: Can't create flow keys file \"{}\": {}".format(
+            options.flow_keys, e.strerror))
+        sys.exit(-1)
+
+    try:
+        log_file = open(options.log, "w")
+    except (FileNotFoundError, IOError, PermissionError) as e:
+        print("ERROR: Can't create log file \"{}\": {}".format(
+            options.log, e.strerror))
+        sys.exit(-1)
+
 
     #
     # Uncomment to see how arguments are decoded.
@@ -231,14 +1928,64 @@ def main():
     
     source = ebpf_source.replace("<BUFFER_PAGE_CNT>",
                             str(options.buffer_page_count))
-    if options.cmd:
-        source += ebpf_source_cmd
-    if options.upcalls:
-        source += ebpf_source_upcalls
-    if options.table:
-        source += ebpf_source_table_ops
+    if options.aggregate_ms is not None:
+        source = f"#define AGGREGATE_NS {options.aggregate_ms * 1_000_000}ull\n" + source
+    if options.sample_rate > 1:
+        source = f"#define SAMPLE_RATE {options.sample_rate}\n" + source
+    if options.only_comm:
+        source = "#define FILTER_ONLY_COMM\n" + source
+    if options.exclude_comm:
+        source = "#define FILTER_EXCLUDE_COMM\n" + source
+    if options.only_pid:
+        source = "#define FILTER_ONLY_PID\n" + source
+    if options.flight_recorder is not None or options.metrics is not None:
+        source = "#define COUNT_EVENTS\n" + source
+    hooks = {}
+    def hook(function, kind, statement):
+        hooks.setdefault((function, kind), []).append(statement)
+
+    for enabled, events in [(options.cmd, ebpf_hooks_cmd), (options.upcalls, ebpf_hooks_upcalls), (options.table, ebpf_hooks_table_ops)]:
+        if enabled:
+            for function, event in events.items():
+                hook(function, "entry", f"handle({event});")
+    if options.latency_histograms:
+        source += ebpf_source_latency
+        for probe, function in enumerate(LATENCY_PROBES):
+            hook(function, "entry", f"latency_entry({probe});")
+            hook(function, "return", f"latency_return({probe});")
+    if options.flow_keys is not None:
+        source += ebpf_source_flow_keys.replace("<BUFFER_PAGE_CNT>", str(options.buffer_page_count)) \
+                                       .replace("<FLOW_KEYS_LRU_SIZE>", str(options.flow_keys_lru_size))
+        hook("ovs_dp_upcall", "entry", "capture_flow_key(skb);")
+
+    if options.attach == "auto":
+        options.attach = "trampoline" if trampolines_supported() else "kprobe"
+    source += ebpf_source_hooks(hooks, options.attach == "trampoline")
+    print(f"- Attaching using {options.attach}s")
+
+    compile_start = time.monotonic()
+    b, cached = compile_ebpf(source, options.debug & 0xffffff, options.program_cache)
+    compile_sec = time.monotonic() - compile_start
+    print(f"- {'Loaded cached programs' if cached else 'Compiled'} in {compile_sec:.2f}s")
+
+    #
+    # Fill in the filters, nothing passes the "only" filters until then
+    #
+    if options.only_comm or options.exclude_comm:
+        comm_filter = b.get_table("comm_filter")
+        for comm in options.only_comm or options.exclude_comm:
+            # the kernel keeps only TASK_COMM_LEN-1 characters
+            comm_filter[comm_filter.Key(comm.encode()[:15])] = comm_filter.Leaf(1)
+    if options.only_pid:
+        pid_filter = b.get_table("pid_filter")
+        for pid in options.only_pid:
+            pid_filter[pid_filter.Key(pid)] = pid_filter.Leaf(1)
+
+    if options.flow_keys is not None:
+        b['flow_key_events'].open_ring_buffer(receive_flow_key)
 
-    b = BPF(text=source, debug=options.debug & 0xffffff)
+    if options.prog_stats:
+        bpf_stats_enabled = enable_bpf_stats()
 
     #
     # Dump out all events
@@ -250,26 +1997,125 @@ def main():
          
 
     events_received = 0
+    max_backlog = 0
+    backlog_dropped = 0
+    thread_error = None
 
+    recorder = None
+    dump_requested = threading.Event()
+    if options.flight_recorder is not None:
+        recorder = FlightRecorder(binary_writer, int(options.flight_recorder * 1e9), options.flight_recorder_mb * 1024 * 1024)
+        # the stats thread dumps, the handler may have interrupted a log write or the recorder
+        signal.signal(signal.SIGUSR2, lambda signum, frame: dump_requested.set())
 
-    b['events'].open_ring_buffer(receive_event_bcc)
-    while 1:
+
+    metrics_server = None
+    metrics_text = ""
+    if options.metrics is not None:
+        metrics_server = start_metrics_server(options.metrics)
+        print(f"- Serving metrics on {options.metrics}")
+
+    stop = threading.Event()
+    stats = threading.Thread(target=export_stats, args=(stop,), name="stats")
+    stats.start()
+
+    if options.aggregate_ms is not None:
+        while 1:
+            try:
+                time.sleep(0.5)
+                if options.flow_keys is not None:
+                    b.ring_buffer_consume()
+                drain_buckets()
+                rotate_export()
+            except KeyboardInterrupt:
+                break
+        stop.set()
+        if options.flow_keys is not None:
+            b.ring_buffer_consume()
+        drain_buckets(final=True)
+    else:
+        b['events'].open_ring_buffer(receive_event)
+
+        batches = queue.Queue(maxsize=options.max_backlog_batches)
+        free_batches = queue.Queue()
+        reader = threading.Thread(target=read_events, args=(stop,), name="reader")
+        writer = threading.Thread(target=write_events, args=(stop,), name="writer")
+        reader.start()
+        writer.start()
         try:
-            b.ring_buffer_poll()
-            time.sleep(0.5)
+            stop.wait()
         except KeyboardInterrupt:
-            break
-    
+            pass
+        stop.set()
+        reader.join()
+        writer.join()
+    stats.join()
+
+    if thread_error is not None:
+        raise thread_error
+
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+        if "/" in options.metrics:
+            os.unlink(options.metrics)
+
+    prog_stats = None
+    if options.prog_stats:
+        prog_stats = collect_prog_stats()
+        with open(BPF_STATS_SYSCTL, "w") as f:
+            f.write(bpf_stats_enabled)
+
     from bcc.table import PerCpuArray
     dropcnt: PerCpuArray = b.get_table("dropcnt")
     events_dropped = sum([sum(x) for x in dropcnt.values()])
-    print(f"received {events_received} events, dropped {events_dropped} events")
+    comms_dropped = sum(b.get_table("commdropcnt")[0])
+    ringfill: PerCpuArray = b.get_table("ringfill")
+    ring_max_fill = max(ringfill[0]) / (options.buffer_page_count * resource.getpagesize())
+    occupancy = b.get_table("occupancy")
+    print(f"received {events_received} events, dropped {events_dropped} events, ring buffer was at most {ring_max_fill:.0%} full")
+    if backlog_dropped > 0:
+        print(f"dropped {backlog_dropped} received events, the writer was more than {options.max_backlog_batches} batches behind")
+    if comms_dropped > 0:
+        print(f"{comms_dropped} times a thread name could not be stored, the comms map was full")
 
     export_file.close()
 
+    if flow_keys_file is not None:
+        write_flow_key_totals()
+        flow_keys_file.close()
+
     # write log
-    with open(options.log, 'w') as f:
-        print(json.dumps({"event": "LOG", "events_dropped": events_dropped, "events_received": events_received}), file=f)
+    write_comms()
+    write_log({
+        "event": "LOG",
+        "events_dropped": events_dropped,
+        "events_received": events_received,
+        "aggregate_ms": options.aggregate_ms,
+        "format": options.format,
+        "ring_max_fill": ring_max_fill,
+        "max_batch_backlog": max_backlog,
+        "events_dropped_backlog": backlog_dropped,
+        "comms_dropped": comms_dropped,
+        "table_flows": occupancy[0].value,
+        "cmd_flows": occupancy[1].value,
+        "only_comm": options.only_comm,
+        "exclude_comm": options.exclude_comm,
+        "only_pid": options.only_pid,
+        "sample_rate": options.sample_rate,
+        "latency_histograms": options.latency_histograms,
+        "flow_keys": options.flow_keys,
+        "compile_sec": compile_sec,
+        "program_cache_hit": cached,
+        "attach": options.attach,
+        "prog_stats": prog_stats,
+        "flight_recorder": options.flight_recorder,
+        "dumps": recorder.dumps if recorder is not None else 0,
+        "metrics": options.metrics,
+        "compress": options.compress,
+        "parts": len(export_output.parts) if export_output is not None else None,
+    })
+    log_file.close()
 
 
 if __name__ == '__main__':
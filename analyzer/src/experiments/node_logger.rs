@@ -1,4 +1,7 @@
-use std::{path::Path, time::Duration};
+use std::{
+    path::{Path, PathBuf},
+    time::Duration,
+};
 
 use clap::Parser;
 
@@ -25,6 +28,45 @@ pub struct LogNodeArgs {
     /// use offcputime to monitor ovs-vswitchd
     #[arg(long, action)]
     offcputime: bool,
+
+    /// compress the kernel trace while recording it (gzip, zstd or lz4)
+    #[arg(long)]
+    trace_compress: Option<String>,
+
+    /// split the kernel trace into parts of this many MB
+    #[arg(long)]
+    trace_rotate_mb: Option<u64>,
+
+    /// how the kernel tracer attaches (auto, trampoline or kprobe), or off to run without it,
+    /// for comparing the cost of the tracer on the same workload
+    #[arg(long, default_value = "auto")]
+    tracer_attach: String,
+}
+
+/// files of the kernel trace, compressed or rotated traces are split into `FILE.NNN` parts
+/// listed in `FILE.manifest.json`. Without any of them the file itself is returned, so that
+/// its absence gets reported
+fn trace_files(filename: &str) -> Vec<PathBuf> {
+    let path = Path::new(filename);
+    if path.exists() {
+        return vec![path.to_path_buf()];
+    }
+
+    let prefix = format!("{}.", filename);
+    let mut files: Vec<PathBuf> = std::fs::read_dir(".")
+        .map(|entries| {
+            entries
+                .filter_map(|entry| entry.ok())
+                .filter(|entry| entry.file_name().to_string_lossy().starts_with(&prefix))
+                .map(|entry| entry.path())
+                .collect()
+        })
+        .unwrap_or_default();
+    if files.is_empty() {
+        return vec![path.to_path_buf()];
+    }
+    files.sort();
+    files
 }
 
 pub fn run(args: LogNodeArgs, handler: Box<impl ResultHandler + ?Sized>) -> anyhow::Result<()> {
@@ -39,7 +81,7 @@ pub fn run(args: LogNodeArgs, handler: Box<impl ResultHandler + ?Sized>) -> anyh
     let filename_loadavg = dump_file("loadavg", "csv");
 
     /* start kernel tracing logging */
-    let tracer_args = if args.only_upcalls {
+    let mut tracer_args = if args.only_upcalls {
         vec![
             "-w",
             &filename_trace,
@@ -53,9 +95,23 @@ pub fn run(args: LogNodeArgs, handler: Box<impl ResultHandler + ?Sized>) -> anyh
     } else {
         vec!["-w", &filename_trace, "-l", &filename_log, "--signal-ready"]
     };
-    let kernel_tracer = run_external_program_async(include_bytes!("log_flow_ops.py"), &tracer_args)
-        .expect("failed to start kernel tracing");
-    wait_for_signal(signal_hook::consts::SIGUSR1)?;
+    if let Some(compress) = &args.trace_compress {
+        tracer_args.extend(["--compress", compress.as_str()]);
+    }
+    let rotate_mb = args.trace_rotate_mb.map(|mb| mb.to_string());
+    if let Some(rotate_mb) = &rotate_mb {
+        tracer_args.extend(["--rotate-mb", rotate_mb.as_str()]);
+    }
+    tracer_args.extend(["--attach", args.tracer_attach.as_str()]);
+    let tracer_enabled = args.tracer_attach != "off";
+    let mut kernel_tracer = None;
+    if tracer_enabled {
+        kernel_tracer = Some(
+            run_external_program_async(include_bytes!("log_flow_ops.py"), &tracer_args)
+                .expect("failed to start kernel tracing"),
+        );
+        wait_for_signal(signal_hook::consts::SIGUSR1)?;
+    }
 
     /* perf */
     let mut perf = None;
@@ -116,9 +172,11 @@ pub fn run(args: LogNodeArgs, handler: Box<impl ResultHandler + ?Sized>) -> anyh
         .stop()
         .inspect_err(|e| warn!("loadavg collector failed: {}", e));
     info!("stopping kernel tracer");
-    _ = kernel_tracer
-        .stop()
-        .inspect_err(|e| warn!("collector failed: {}", e));
+    if let Some(kernel_tracer) = kernel_tracer {
+        _ = kernel_tracer
+            .stop()
+            .inspect_err(|e| warn!("collector failed: {}", e));
+    }
     info!("stopping usdt tracer");
     _ = usdt
         .stop()
@@ -140,8 +198,13 @@ pub fn run(args: LogNodeArgs, handler: Box<impl ResultHandler + ?Sized>) -> anyh
     /* process results */
     handler.handle_result(Path::new(&filename_system));
     handler.handle_result(Path::new(&filename_dumps));
-    handler.handle_result(Path::new(&filename_trace));
-    handler.handle_result(Path::new(&filename_log));
+    // without the tracer there is no trace and no tracer log
+    if tracer_enabled {
+        for file in trace_files(&filename_trace) {
+            handler.handle_result(&file);
+        }
+        handler.handle_result(Path::new(&filename_log));
+    }
     handler.handle_result(Path::new(&filename_perf));
     handler.handle_result(Path::new(&filename_usdt));
     handler.handle_result(Path::new(&filename_offcputime));